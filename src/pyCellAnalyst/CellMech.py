@@ -1,20 +1,353 @@
 from __future__ import print_function
 from __future__ import division
-from builtins import str
-from builtins import range
-from builtins import object
-from past.utils import old_div
 import vtk
 import os
+import hashlib
 import pickle
+import tempfile
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 import SimpleITK as sitk
 import numpy as np
-from vtk.util import vtkImageImportFromArray as vti
-from vtk.util.numpy_support import (vtk_to_numpy, numpy_to_vtk) 
+from scipy.ndimage import map_coordinates
+from scipy.spatial import cKDTree
+from vtk.util.numpy_support import (vtk_to_numpy, numpy_to_vtk,
+                                    numpy_to_vtkIdTypeArray)
 from tetmesh import mesh
 
 
+# vertex index pairs (head, tail) of the 6 edges of a tetrahedron
+_TET_EDGES = np.array([[1, 0], [2, 0], [3, 0], [3, 1], [3, 2], [2, 1]])
+
+# Voigt index (xx, yy, zz, xy, xz, yz) of each symmetric tensor component
+_VOIGT = np.array([[0, 3, 4], [3, 1, 5], [4, 5, 2]])
+
+# Levi-Civita tensor
+_LC = np.zeros((3, 3, 3))
+_LC[0, 1, 2] = _LC[1, 2, 0] = _LC[2, 0, 1] = 1.0
+_LC[0, 2, 1] = _LC[2, 1, 0] = _LC[1, 0, 2] = -1.0
+
+
+def _make3Dmesh(filename, vConst, settings):
+    """
+    Generates a 3-D tetrahedral mesh using tetmesh module build on CGAL.
+    These meshes are then used to determine the object's volume, centroid,
+    and the axes of the ellipsoid that has equivalent principal moments of
+    inertia.
+
+    This is defined at module level, so **CellMech._readstls()** can dispatch
+    each object to a separate worker process if requested. Only NumPy arrays
+    and floats are returned, since VTK objects cannot be passed between
+    processes.
+
+    Parameters
+    ----------
+    filename : str
+        The path and filename of the STL surface currently being analyzed. This
+        is necessary since tetmesh has to read the STL from disk in its native format.
+    vConst : float
+        The volume enclosed by the STL surface. Used to determine the target
+        element edge length.
+    settings : dict
+        The **meshSettings** of **CellMech**.
+
+    Returns
+    -------
+    (nodes, elements, surface nodes, vertex type, volume, centroid, axes)
+        Element and surface node indices are zero-based. The vertex type is
+        the "Vertex Type" point data of the tetmesh output.
+    """
+    vConst /= float(settings.get('Elements', 50000))
+    edgeSize = (vConst * 12 / np.sqrt(2)) ** (1.0 / 3.0)
+    # unique output file, so concurrent workers do not overwrite each other
+    fd, outputname = tempfile.mkstemp(suffix='.vtu')
+    os.close(fd)
+    try:
+        m = mesh.Mesher(inputname=filename,
+                        outputname=outputname,
+                        facetAngle=settings.get('Facet Angle', 30.0),
+                        facetDistance=settings.get('Facet Distance', 0.1),
+                        edgeLength=edgeSize,
+                        edgeRatio=settings.get('Edge Ratio', 1.3))
+        m.makeMesh()
+
+        gridReader = vtk.vtkXMLUnstructuredGridReader()
+        gridReader.SetFileName(outputname)
+        gridReader.Update()
+        vtkMesh = gridReader.GetOutput()
+    finally:
+        os.remove(outputname)
+    nodes = np.array(vtk_to_numpy(vtkMesh.GetPoints().GetData()), np.float64)
+    elements = np.array(vtk_to_numpy(
+        vtkMesh.GetCells().GetConnectivityArray()).reshape(-1, 4))
+    vertex_type = np.array(vtk_to_numpy(
+        vtkMesh.GetPointData().GetArray("Vertex Type")))
+    s_nodes = np.argwhere(vertex_type==1).ravel()
+
+    n1 = nodes[elements[:, 0], :]
+    n2 = nodes[elements[:, 1], :]
+    n3 = nodes[elements[:, 2], :]
+    n4 = nodes[elements[:, 3], :]
+    tetraCents = (n1 + n2 + n3 + n4) / 4.0
+    # scalar triple product of the edges from node 1
+    tetraVols = np.abs(np.einsum('ni,nj,nk,ijk->n',
+                                 n4 - n1, n3 - n1, n2 - n1, _LC)) / 6.0
+
+    totalVol = np.sum(tetraVols)
+    centroid = np.dot(tetraVols, tetraCents) / totalVol
+    tetraCents -= centroid
+
+    # inertia tensor from the volume-weighted second moment of the centroids
+    M = np.einsum('n,ni,nj->ij', tetraVols, tetraCents, tetraCents)
+    I = np.trace(M) * np.eye(3) - M
+    # principal moments in ascending order
+    w = np.linalg.eigvalsh(I)
+    r_major = np.sqrt(5 * (w[1] + w[2] - w[0]) / (2 * totalVol))
+    r_middle = np.sqrt(5 * (w[0] - w[1] + w[2]) / (2 * totalVol))
+    r_minor = np.sqrt(5 * (w[0] + w[1] - w[2]) / (2 * totalVol))
+    return (nodes, elements, s_nodes, vertex_type, totalVol, centroid,
+            [r_major, r_middle, r_minor])
+
+
+def _tetStrain(P, p):
+    """
+    Solves for the Green-Lagrange strain of a tetrahedron from its (4, 3)
+    reference vertices **P** and deformed vertices **p** using the changes
+    in squared length of its 6 edges.
+
+    Returns the strain as a (3, 3) ndarray.
+    """
+    X = P[_TET_EDGES[:, 0]] - P[_TET_EDGES[:, 1]]
+    x = p[_TET_EDGES[:, 0]] - p[_TET_EDGES[:, 1]]
+
+    #assemble the system
+    dX = np.stack([2 * X[:, 0] ** 2,
+                   2 * X[:, 1] ** 2,
+                   2 * X[:, 2] ** 2,
+                   4 * X[:, 0] * X[:, 1],
+                   4 * X[:, 0] * X[:, 2],
+                   4 * X[:, 1] * X[:, 2]], axis=1)
+    ds = np.einsum('ij,ij->i', x, x) - np.einsum('ij,ij->i', X, X)
+
+    return np.linalg.solve(dX, ds)[_VOIGT]
+
+
+def _listSTLs(directory):
+    """
+    Returns the sorted paths of the STL files in **directory**.
+    """
+    return sorted(os.path.normpath(entry.path)
+                  for entry in os.scandir(directory)
+                  if entry.is_file() and entry.name.lower().endswith('.stl'))
+
+
+def _readSTL(filename):
+    """
+    Reads an STL file into a vtkPolyData of triangles. Binary files are
+    parsed with a single bulk NumPy operation instead of per-triangle
+    parsing, and coincident vertices are merged in order of first appearance
+    as they are by vtkSTLReader, so the point numbering is the same. Any
+    other file, e.g. ASCII or binary with trailing bytes, is read with
+    vtkSTLReader.
+
+    Parameters
+    ----------
+    filename : str
+        The path and filename of the STL surface.
+
+    Returns
+    -------
+    vtkPolyData
+    """
+    with open(filename, 'rb') as fid:
+        data = fid.read()
+    ntri = -1
+    if len(data) >= 84:
+        ntri = int(np.frombuffer(data, np.uint32, count=1, offset=80)[0])
+    if len(data) != 84 + 50 * ntri:
+        reader = vtk.vtkSTLReader()
+        reader.SetFileName(filename)
+        reader.Update()
+        triangles = vtk.vtkTriangleFilter()
+        triangles.SetInputConnection(reader.GetOutputPort())
+        triangles.Update()
+        return triangles.GetOutput()
+
+    record = np.dtype([('n', '<f4', (3,)), ('v', '<f4', (9,)),
+                       ('att', '<u2')])
+    tris = np.frombuffer(data, record, count=ntri, offset=84)['v']
+    tris = tris.reshape(-1, 3)
+    # np.unique sorts the vertices, so renumber them by first appearance
+    _, first, inverse = np.unique(tris, axis=0, return_index=True,
+                                  return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    points = tris[first[order]]
+    faces = rank[inverse.ravel()].reshape(-1, 3)
+    # discard degenerate triangles
+    faces = faces[(faces[:, 0] != faces[:, 1]) &
+                  (faces[:, 1] != faces[:, 2]) &
+                  (faces[:, 0] != faces[:, 2])]
+
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_to_vtk(points, deep=True))
+    poly = vtk.vtkPolyData()
+    poly.SetPoints(vtkPoints)
+    poly.SetPolys(_cellArray(faces))
+    return poly
+
+
+def _mat4_to_np(matrix):
+    """
+    Returns the elements of a vtkMatrix4x4 as a (4, 4) ndarray.
+    """
+    # copy all 16 elements with one call rather than 16 GetElement calls
+    elements = np.empty(16, np.float64)
+    matrix.DeepCopy(elements, matrix)
+    return elements.reshape(4, 4)
+
+
+def _rigidFit(source, target):
+    """
+    Returns the (4, 4) rigid body transform that best maps the (N, 3) array of
+    points **source** to the corresponding points **target** in the least
+    squares sense (SVD of the cross-covariance).
+    """
+    scent = source.mean(axis=0)
+    tcent = target.mean(axis=0)
+    U, s, Vt = np.linalg.svd(np.dot((source - scent).T, target - tcent))
+    D = np.eye(3)
+    D[2, 2] = np.sign(np.linalg.det(np.dot(Vt.T, U.T)))
+    T = np.eye(4)
+    T[0:3, 0:3] = np.dot(Vt.T, np.dot(D, U.T))
+    T[0:3, 3] = tcent - np.dot(T[0:3, 0:3], scent)
+    return T
+
+
+def _affineFit(source, target):
+    """
+    Returns the (4, 4) affine transform that best maps the (N, 3) array of
+    points **source** to the corresponding points **target** in the least
+    squares sense.
+    """
+    A = np.linalg.lstsq(np.hstack((source, np.ones((source.shape[0], 1)))),
+                        target, rcond=None)[0]
+    T = np.eye(4)
+    T[0:3, 0:3] = A[0:3].T
+    T[0:3, 3] = A[3]
+    return T
+
+
+def _icp(source, target, affine=False, tolerance=0.001, iterations=5000):
+    """
+    Iterative closest point registration of the (N, 3) array of points **source**
+    to the (M, 3) array of points **target**. Closest points are queried from a
+    KD-tree of the target points built once, and each iteration solves for the
+    rigid body (SVD) or affine (least squares) transform mapping **source** to its
+    current closest points. Like vtkIterativeClosestPointTransform, the centroids
+    are matched initially and iterations stop when the root-mean-square change in
+    the transformed source points falls below **tolerance**.
+
+    Returns the transform as a (4, 4) ndarray.
+    """
+    tree = cKDTree(target)
+    if affine:
+        fit = _affineFit
+    else:
+        fit = _rigidFit
+    T = np.eye(4)
+    T[0:3, 3] = target.mean(axis=0) - source.mean(axis=0)
+    moved = source + T[0:3, 3]
+    for i in range(iterations):
+        T = fit(source, target[tree.query(moved)[1]])
+        current = np.dot(source, T[0:3, 0:3].T) + T[0:3, 3]
+        change = np.sqrt(np.mean(np.sum((current - moved) ** 2, axis=1)))
+        moved = current
+        if change <= tolerance:
+            break
+    return T
+
+
+def _interpolateGrid(arrays, origin, spacing, points):
+    """
+    Trilinear interpolation of point data defined on a regular grid. Points
+    outside the grid take the value at the nearest boundary.
+
+    Parameters
+    ----------
+    arrays : [,ndarray((nz, ny, nx, ncomp), float),...]
+        Point data on the grid in SimpleITK (z, y, x) array order.
+    origin : ndarray(3, float)
+        Physical coordinates of the first grid point.
+    spacing : ndarray(3, float)
+        Grid spacing.
+    points : ndarray((N, 3), float)
+        Physical coordinates to interpolate at.
+
+    Returns
+    -------
+    [,ndarray((N, ncomp), float),...]
+    """
+    # continuous (z, y, x) indices of the points
+    idx = ((points - origin) / spacing)[:, ::-1].T
+    return [np.stack([map_coordinates(a[..., c], idx, order=1, mode='nearest')
+                      for c in range(a.shape[-1])], axis=1)
+            for a in arrays]
+
+
+def _probeGrid(dataset, grids, origin, spacing):
+    """
+    Returns a shallow copy of **dataset** with the displacement and strain
+    fields in **grids** interpolated to its points by **_interpolateGrid()**.
+    """
+    points = vtk_to_numpy(dataset.GetPoints().GetData())
+    values = _interpolateGrid(grids, origin, spacing, points)
+    field = dataset.NewInstance()
+    field.ShallowCopy(dataset)
+    for name, v in zip(("Displacement", "Strain"), values):
+        arr = numpy_to_vtk(v, deep=True, array_type=vtk.VTK_DOUBLE)
+        arr.SetName(name)
+        field.GetPointData().AddArray(arr)
+    field.GetPointData().SetActiveVectors("Displacement")
+    field.GetPointData().SetActiveTensors("Strain")
+    return field
+
+
+def _cellArray(cells):
+    """
+    Builds a vtkCellArray from an (N, k) array of point indices, passing
+    the connectivity and offsets directly rather than a legacy cell array
+    with each cell prefixed by its size.
+    """
+    n, k = cells.shape
+    offsets = numpy_to_vtkIdTypeArray(
+        np.arange(0, k * (n + 1), k, dtype=np.int64), deep=True)
+    conn = numpy_to_vtkIdTypeArray(cells.astype(np.int64).ravel(), deep=True)
+    array = vtk.vtkCellArray()
+    array.SetData(offsets, conn)
+    return array
+
+
+def _arrays2grid(nodes, elements, vertex_type):
+    """
+    Builds a vtkUnstructuredGrid of linear tetrahedrons from the node,
+    zero-based element and vertex type arrays returned by **_make3Dmesh()**.
+    The vertex types are attached as the "Vertex Type" point data, as in the
+    tetmesh output.
+    """
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(nodes, deep=True, array_type=vtk.VTK_DOUBLE))
+    grid = vtk.vtkUnstructuredGrid()
+    grid.SetPoints(points)
+    grid.SetCells(vtk.VTK_TETRA, _cellArray(elements))
+    vtype = numpy_to_vtk(vertex_type, deep=True)
+    vtype.SetName("Vertex Type")
+    grid.GetPointData().AddArray(vtype)
+    return grid
+
+
 class CellMech(object):
     """Quantifies deformation between objects in reference and deformed states.
 
@@ -32,6 +365,15 @@ class CellMech(object):
         The directory containing the STL files corresponding to the deformed state.
     rigidInitial : bool, optional
         If *True* do an initial rigid body transformation to align objects.
+    icpMethod : str, optional
+        The iterative closest point implementation used to align objects.
+            * **VTK:** (default) vtkIterativeClosestPointTransform, matching 200 reference surface
+              vertices to the closest points on the deformed surface.
+            * **KDTree:** Matches all reference surface vertices to the closest deformed surface
+              vertices using a KD-tree. Much faster for finely triangulated surfaces.
+            * **Correspondence:** For surfaces with identical triangulations, e.g. a reference surface
+              deformed by a known transform, the transforms are fit directly to the corresponding
+              vertices without iteration. Falls back to **VTK** for objects whose triangulations differ.
     deformable : bool, optional
         If *True* deformable image registration will be performed. This will call
         deformableRegistration(), which will calculate a displacement map between
@@ -46,6 +388,24 @@ class CellMech(object):
             * **Maximum RMS:** (float, 0.01) Will terminate iterations if root-mean-square error is less than.
             * **Displacement Smoothing:** (float, 3.0) Variance for Gaussian smoothing of displacement field result.
             * **Precision:** (float, 0.01) The fraction of the object bounding box in each dimension spanned by 1 voxel. 
+            * **Interpolation Downsample:** (int, 1) Interpolate displacements and strains to the object mesh
+              from every n-th voxel of the registration grid. The displacement field is Gaussian smoothed, so values up to
+              half of **Displacement Smoothing** give nearly identical results at a fraction of the cost.
+            * **Use Cache:** (bool, False) If *True* the anti-aliased images reconstructed from the surfaces are
+              cached in *~/.pyCellAnalyst_cache* and reused when registration is repeated on the same objects.
+    meshSettings : dict, optional
+        Settings for the tetrahedral meshes of the objects with fields:
+            * **Elements:** (int, 50000) The approximate number of elements in each mesh. The volumes, centroids
+              and equivalent ellipsoid axes change little with fewer elements, so this can be reduced for
+              faster analyses when **saveFEA** and **deformable** are *False*.
+            * **Facet Angle:** (float, 30.0) The lower bound in degrees for the angles of surface facets.
+            * **Facet Distance:** (float, 0.1) The upper bound for the distance between surface facets and the
+              input surface.
+            * **Edge Ratio:** (float, 1.3) The upper bound for the ratio of element circumradius to shortest edge.
+              Larger values relax element quality and reduce meshing time.
+            * **Processes:** (int, 1) The number of worker processes meshing the objects in parallel. With
+              more than 1, scripts must guard their entry point with *if __name__ == '__main__':* on
+              platforms that spawn processes (Windows, macOS).
     display : bool, optional
         If *True* will display 3-D interactive rendering of displacement fields.
 
@@ -57,24 +417,24 @@ class CellMech(object):
         Polygonal surfaces of objects in deformed state.
     rmeshes : [,vtkUnstructuredGrid,...]
         Tetrahedral meshes of undeformed geometries.
-    rcentroids : [,ndarray(3, float),...]
+    rcentroids : ndarray((N, 3), float)
         Volumetric centroids of objects in reference state.
-    dcentroids : [,ndarray(3, float),...]
+    dcentroids : ndarray((N, 3), float)
         Volumetric centroids of objects in deformed state.
-    cell_strains : [,ndarray((3,3), float)
+    cell_strains : ndarray((N, 3, 3), float)
         Green-Lagrange strain tensors for object assuming uniform deformation.
-    vstrains : [, float, ...]
+    vstrains : ndarray(N, float)
         Volumetric strains of the analyzed objects.
     ecm_strain : ndarray((3,3), float)
         Green-Lagrange strain tensor for extracellular (extra-object) matrix assuming
         uniform deformation.
-    rvols : [,float,...]
+    rvols : ndarray(N, float)
         Volumes of objects in reference state.
-    dvols : [,float,...]
+    dvols : ndarray(N, float)
         Volumes of objects in deformed state.
-    raxes : [,ndarray(3, float),...]
+    raxes : ndarray((N, 3), float)
         Lengths of axes for ellipsoid with equivalent principal moments of inertia to object in reference state.
-    daxes : [,ndarray(3, float),...]
+    daxes : ndarray((N, 3), float)
         Lengths of axes for ellisoid with equivalent principal moments of inertia to object in deformed state.
     cell_fields : [,vtkUnstructuredGrid,...]
         Displacement vectors determined by deformable image registration interpolated to the vertices of object
@@ -88,12 +448,20 @@ class CellMech(object):
                  ref_dir=None,
                  def_dir=None,
                  rigidInitial=True,
+                 icpMethod='VTK',
                  deformable=False,
                  saveFEA=False,
                  deformableSettings={'Iterations': 200,
                                      'Maximum RMS': 0.01,
                                      'Displacement Smoothing': 3.0,
-                                     'Precision': 0.01},
+                                     'Precision': 0.01,
+                                     'Interpolation Downsample': 1,
+                                     'Use Cache': False},
+                 meshSettings={'Elements': 50000,
+                               'Facet Angle': 30.0,
+                               'Facet Distance': 0.1,
+                               'Edge Ratio': 1.3,
+                               'Processes': 1},
                  display=False):
 
         if ref_dir is None:
@@ -105,23 +473,29 @@ class CellMech(object):
         self._ref_dir = ref_dir
         self._def_dir = def_dir
         self.rigidInitial = rigidInitial
+        if icpMethod not in ('VTK', 'KDTree', 'Correspondence'):
+            raise SystemExit(("icpMethod must be 'VTK', 'KDTree' or "
+                              "'Correspondence'. "
+                              "Terminating..."))
+        self.icpMethod = icpMethod
         self.display = display
         self.deformable = deformable
         self.saveFEA = saveFEA
         self.deformableSettings = deformableSettings
+        self.meshSettings = meshSettings
 
         self.rsurfs = []
         self.dsurfs = []
         self.rmeshes = []
-        self.rcentroids = []
-        self.dcentroids = []
-        self.cell_strains = []
-        self.vstrains = []
+        self.rcentroids = np.zeros((0, 3))
+        self.dcentroids = np.zeros((0, 3))
+        self.cell_strains = np.zeros((0, 3, 3))
+        self.vstrains = np.zeros(0)
         self.ecm_strain = None
-        self.rvols = []
-        self.dvols = []
-        self.raxes = []
-        self.daxes = []
+        self.rvols = np.zeros(0)
+        self.dvols = np.zeros(0)
+        self.raxes = np.zeros((0, 3))
+        self.daxes = np.zeros((0, 3))
 
 
         self.cell_fields = []
@@ -149,57 +523,80 @@ class CellMech(object):
                        'elements': self._elements[i],
                        'surfaces': self._snodes[i],
                        'boundary conditions': bc}
-                fid = open(str(os.path.normpath(
-                    self._def_dir + os.sep + 'cellFEA{:02d}.pkl'
-                    .format(i))), 'wb')
-                pickle.dump(fea, fid)
-                fid.close()
+                with open(str(os.path.normpath(
+                        self._def_dir + os.sep + 'cellFEA{:02d}.pkl'
+                        .format(i))), 'wb', buffering=1 << 20) as fid:
+                    pickle.dump(fea, fid, protocol=pickle.HIGHEST_PROTOCOL)
         print(("Analysis of {:s} completed...".format(self._def_dir)))
 
     def _readstls(self):
         """
         Reads in all STL files contained in directories indicated by **ref_dir** and **def_dir**.
-        Also calls **_make3Dmesh()** to create 3-D tetrahedral meshes.
+        Also calls **_make3Dmesh()** to create 3-D tetrahedral meshes. The objects
+        are independent, so if the **Processes** mesh setting is greater than 1,
+        meshing is distributed over a pool of worker processes.
 
         Returns
         -------
         rsurfs, dsurfs
         """
-        for fname in sorted(os.listdir(self._ref_dir)):
-            if '.stl' in fname.lower():
-                reader = vtk.vtkSTLReader()
-                reader.SetFileName(
-                    str(os.path.normpath(self._ref_dir + os.sep + fname)))
-                reader.Update()
-                triangles = vtk.vtkTriangleFilter()
-                triangles.SetInputConnection(reader.GetOutputPort())
-                triangles.Update()
-                self.rsurfs.append(triangles.GetOutput())
-                massProps = vtk.vtkMassProperties()
-                massProps.SetInputData(self.rsurfs[-1])
-                massProps.Update()
-                print(("Generating tetrahedral mesh from {:s}".format(fname)))
-                self._make3Dmesh(
-                    str(os.path.normpath(self._ref_dir + os.sep + fname)),
-                    'MATERIAL', massProps.GetVolume())
-
-        for fname in sorted(os.listdir(self._def_dir)):
-            if '.stl' in fname.lower():
-                reader = vtk.vtkSTLReader()
-                reader.SetFileName(
-                    str(os.path.normpath(self._def_dir + os.sep + fname)))
-                reader.Update()
-                triangles = vtk.vtkTriangleFilter()
-                triangles.SetInputConnection(reader.GetOutputPort())
-                triangles.Update()
-                self.dsurfs.append(triangles.GetOutput())
+        rfiles = _listSTLs(self._ref_dir)
+        dfiles = _listSTLs(self._def_dir)
+        rnames = [os.path.basename(f) for f in rfiles]
+        dnames = [os.path.basename(f) for f in dfiles]
+        if rnames != dnames:
+            raise SystemExit(("The STL files in {:s} and {:s} are not named the "
+                              "same. Terminating...".format(self._ref_dir,
+                                                            self._def_dir)))
+        volumes = []
+        for files, surfs in [(rfiles, self.rsurfs), (dfiles, self.dsurfs)]:
+            for filename in files:
+                surfs.append(_readSTL(filename))
                 massProps = vtk.vtkMassProperties()
-                massProps.SetInputData(self.dsurfs[-1])
+                massProps.SetInputData(surfs[-1])
                 massProps.Update()
-                print(("Generating tetrahedral mesh from {:s}".format(fname)))
-                self._make3Dmesh(
-                    str(os.path.normpath(self._def_dir + os.sep + fname)),
-                    'SPATIAL', massProps.GetVolume())
+                volumes.append(massProps.GetVolume())
+
+        nref = len(rfiles)
+        self.rcentroids = np.zeros((nref, 3))
+        self.dcentroids = np.zeros((nref, 3))
+        self.rvols = np.zeros(nref)
+        self.dvols = np.zeros(nref)
+        self.raxes = np.zeros((nref, 3))
+        self.daxes = np.zeros((nref, 3))
+        files = rfiles + dfiles
+        # worker processes re-import the calling script on spawn platforms,
+        # so process-based meshing is opt-in
+        processes = self.meshSettings.get('Processes', 1)
+        if processes > 1:
+            for filename in files:
+                print(("Generating tetrahedral mesh from {:s}".format(
+                    os.path.basename(filename))))
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(_make3Dmesh, files, volumes,
+                                            repeat(self.meshSettings)))
+        else:
+            results = []
+            for filename, volume in zip(files, volumes):
+                print(("Generating tetrahedral mesh from {:s}".format(
+                    os.path.basename(filename))))
+                results.append(_make3Dmesh(filename, volume,
+                                           self.meshSettings))
+        for i, (nodes, elements, s_nodes, vertex_type,
+                totalVol, centroid, axes) in enumerate(results):
+            if i < nref:
+                self.rmeshes.append(_arrays2grid(nodes, elements,
+                                                 vertex_type))
+                self._snodes.append(s_nodes + 1)
+                self._elements.append(elements + 1)
+                self._nodes.append(nodes)
+                self.raxes[i] = axes
+                self.rcentroids[i] = centroid
+                self.rvols[i] = totalVol
+            else:
+                self.daxes[i - nref] = axes
+                self.dcentroids[i - nref] = centroid
+                self.dvols[i - nref] = totalVol
 
     def _deform(self):
         r"""
@@ -221,49 +618,109 @@ class CellMech(object):
         -------
         cell_strains
         """
-        for i in range(len(self.rcentroids)):
-            # volumetric strains
-            self.vstrains.append(old_div(self.dvols[i], self.rvols[i]) - 1)
-
-            ICP = vtk.vtkIterativeClosestPointTransform()
-            rcopy = vtk.vtkPolyData()
-            dcopy = vtk.vtkPolyData()
-            rcopy.DeepCopy(self.rsurfs[i])
-            dcopy.DeepCopy(self.dsurfs[i])
-            ICP.SetSource(rcopy)
-            ICP.SetTarget(dcopy)
-            if self.rigidInitial:
-                ICP.GetLandmarkTransform().SetModeToRigidBody()
-                ICP.SetMaximumMeanDistance(0.001)
-                ICP.SetCheckMeanDistance(1)
-                ICP.SetMaximumNumberOfIterations(5000)
-                ICP.StartByMatchingCentroidsOn()
-                ICP.Update()
-                trans = vtk.vtkTransform()
-                trans.SetMatrix(ICP.GetMatrix())
-                trans.Update()
+        # volumetric strains
+        self.vstrains = self.dvols / self.rvols - 1
+        if self.icpMethod == 'KDTree':
+            icp = self._kdtreeICP
+        elif self.icpMethod == 'Correspondence':
+            icp = self._correspondenceFit
+        else:
+            icp = self._vtkICP
+        n = self.rcentroids.shape[0]
+        if icp == self._vtkICP:
+            # the VTK wrappers hold the GIL, so threads would not overlap
+            results = [icp(i) for i in range(n)]
+        else:
+            # cKDTree queries and the NumPy linear algebra release the GIL
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                results = list(executor.map(icp, range(n)))
+        self.cell_strains = np.zeros((n, 3, 3))
+        for i, (F, trans) in enumerate(results):
+            self.cell_strains[i] = 0.5 * (np.dot(F.T, F) - np.eye(3))
+            if trans is not None:
                 self.rigidTransforms.append(trans)
-                rot = vtk.vtkTransformPolyDataFilter()
-                rot.SetInputData(rcopy)
-                rot.SetTransform(trans)
-                rot.Update()
-                ICP.GetLandmarkTransform().SetModeToAffine()
-                ICP.SetSource(rot.GetOutput())
-                ICP.Update()
-            else:
-                ICP.GetLandmarkTransform().SetModeToAffine()
-                ICP.SetMaximumMeanDistance(0.001)
-                ICP.SetCheckMeanDistance(1)
-                ICP.SetMaximumNumberOfIterations(5000)
-                ICP.StartByMatchingCentroidsOn()
-                ICP.Update()
-
-            F = np.zeros((3, 3), float)
-            for j in range(3):
-                for k in range(3):
-                    F[j, k] = ICP.GetMatrix().GetElement(j, k)
-            E = 0.5 * (np.dot(F.T, F) - np.eye(3))
-            self.cell_strains.append(E)
+
+    def _vtkICP(self, i):
+        """
+        Returns the deformation gradient of object **i** determined with
+        vtkIterativeClosestPointTransform, and the initial rigid body
+        transform (*None* if **rigidInitial** is *False*).
+        """
+        trans = None
+        ICP = vtk.vtkIterativeClosestPointTransform()
+        ICP.SetSource(self.rsurfs[i])
+        ICP.SetTarget(self.dsurfs[i])
+        if self.rigidInitial:
+            ICP.GetLandmarkTransform().SetModeToRigidBody()
+            ICP.SetMaximumMeanDistance(0.001)
+            ICP.SetCheckMeanDistance(1)
+            ICP.SetMaximumNumberOfIterations(5000)
+            ICP.StartByMatchingCentroidsOn()
+            ICP.Update()
+            trans = vtk.vtkTransform()
+            trans.SetMatrix(ICP.GetMatrix())
+            trans.Update()
+            rot = vtk.vtkTransformPolyDataFilter()
+            rot.SetInputData(self.rsurfs[i])
+            rot.SetTransform(trans)
+            rot.Update()
+            ICP.GetLandmarkTransform().SetModeToAffine()
+            ICP.SetSource(rot.GetOutput())
+            ICP.Update()
+        else:
+            ICP.GetLandmarkTransform().SetModeToAffine()
+            ICP.SetMaximumMeanDistance(0.001)
+            ICP.SetCheckMeanDistance(1)
+            ICP.SetMaximumNumberOfIterations(5000)
+            ICP.StartByMatchingCentroidsOn()
+            ICP.Update()
+        return _mat4_to_np(ICP.GetMatrix())[0:3, 0:3], trans
+
+    def _kdtreeICP(self, i):
+        """
+        Returns the deformation gradient of object **i** determined with the
+        KD-tree accelerated iterative closest point registration of all surface
+        vertices, and the initial rigid body transform (*None* if **rigidInitial**
+        is *False*).
+        """
+        trans = None
+        rpts = vtk_to_numpy(self.rsurfs[i].GetPoints().GetData()).astype(np.float64)
+        dpts = vtk_to_numpy(self.dsurfs[i].GetPoints().GetData()).astype(np.float64)
+        if self.rigidInitial:
+            T = _icp(rpts, dpts)
+            trans = vtk.vtkTransform()
+            trans.SetMatrix(T.ravel())
+            trans.Update()
+            rpts = np.dot(rpts, T[0:3, 0:3].T) + T[0:3, 3]
+        return _icp(rpts, dpts, affine=True)[0:3, 0:3], trans
+
+    def _correspondenceFit(self, i):
+        """
+        Returns the deformation gradient of object **i** fit directly to the
+        corresponding vertices of identically triangulated reference and deformed
+        surfaces, and the initial rigid body transform (*None* if **rigidInitial**
+        is *False*). Vertices correspond through the corners of each triangle.
+        Falls back to **_vtkICP()** if the triangulations differ.
+        """
+        rpts = vtk_to_numpy(self.rsurfs[i].GetPoints().GetData()).astype(np.float64)
+        dpts = vtk_to_numpy(self.dsurfs[i].GetPoints().GetData()).astype(np.float64)
+        rfaces = vtk_to_numpy(self.rsurfs[i].GetPolys().GetConnectivityArray())
+        dfaces = vtk_to_numpy(self.dsurfs[i].GetPolys().GetConnectivityArray())
+        if rpts.shape != dpts.shape or rfaces.shape != dfaces.shape:
+            return self._vtkICP(i)
+        pair = np.zeros(rpts.shape[0], np.int64)
+        pair[rfaces] = dfaces
+        if not np.array_equal(pair[rfaces], dfaces):
+            return self._vtkICP(i)
+        dpts = dpts[pair]
+        trans = None
+        if self.rigidInitial:
+            T = _rigidFit(rpts, dpts)
+            trans = vtk.vtkTransform()
+            trans.SetMatrix(T.ravel())
+            trans.Update()
+            rpts = np.dot(rpts, T[0:3, 0:3].T) + T[0:3, 3]
+        return _affineFit(rpts, dpts)[0:3, 0:3], trans
 
     def deformableRegistration(self):
         """
@@ -274,6 +731,9 @@ class CellMech(object):
         -------
         cell_fields
         """
+        # renderings block until their window is closed, so they are shown
+        # after all objects are registered rather than between them
+        animations = []
         for r, mesh in enumerate(self.rmeshes):
             print(("Performing deformable image registration for object {:d}"
                   .format(r + 1)))
@@ -283,8 +743,8 @@ class CellMech(object):
             dimg.SetOrigin((0, 0, 0))
 
             steplength = np.min(dimg.GetSpacing()) * 5.0
-            rimg = sitk.AntiAliasBinary(rimg)
-            dimg = sitk.AntiAliasBinary(dimg)
+            rimg = self._antiAlias(rimg, rpoly)
+            dimg = self._antiAlias(dimg, self.dsurfs[r])
 
             #peform the deformable registration
             register = sitk.FastSymmetricForcesDemonsRegistrationFilter()
@@ -306,13 +766,15 @@ class CellMech(object):
 
             disp_field.SetOrigin(origin)
 
-            #translate displacement field to VTK regular grid
-            a = sitk.GetArrayFromImage(disp_field)
+            #translate displacement field to VTK regular grid;
+            #the array shares the memory of disp_field, which outlives
+            #every use of disp in this iteration
+            a = sitk.GetArrayViewFromImage(disp_field)
             disp = vtk.vtkImageData()
             disp.SetOrigin(disp_field.GetOrigin())
             disp.SetSpacing(disp_field.GetSpacing())
             disp.SetDimensions(disp_field.GetSize())
-            arr = numpy_to_vtk(a.ravel(), deep=True, array_type=vtk.VTK_DOUBLE)
+            arr = numpy_to_vtk(a.ravel(), deep=False, array_type=vtk.VTK_DOUBLE)
             arr.SetNumberOfComponents(3)
             arr.SetName("Displacement")
             disp.GetPointData().SetVectors(arr)
@@ -330,9 +792,9 @@ class CellMech(object):
             c2p.Update()
             disp = c2p.GetOutput()
 
-            #use VTK probe filter to interpolate displacements and strains
-            #to 3D meshes of cells and save as UnstructuredGrid (.vtu)
-            # to visualize in ParaView; this is a linear interpolation
+            #interpolate displacements and strains to 3D meshes of cells
+            #and save as UnstructuredGrid (.vtu) to visualize in ParaView;
+            #this is a linear interpolation done directly on the grid arrays
             print("...Interpolating displacements to 3D mesh.")
             if self.rigidInitial:
                 #transform 3D Mesh
@@ -341,26 +803,19 @@ class CellMech(object):
                 tf.SetTransform(self.rigidTransforms[r])
                 tf.Update()
                 mesh = tf.GetOutput()
-            probe = vtk.vtkProbeFilter()
-            probe.SetInputData(mesh)
-            probe.SetSourceData(disp)
-            probe.Update()
-            field = probe.GetOutput()
-            if self.display:
-                probe2 = vtk.vtkProbeFilter()
-                probe2.SetInputData(rpoly)
-                probe2.SetSourceData(disp)
-                probe2.Update()
-
+            dims = tuple(disp_field.GetSize()[::-1])
+            k = max(1, int(self.deformableSettings.get(
+                'Interpolation Downsample', 1)))
+            grids = [vtk_to_numpy(disp.GetPointData().GetArray(name))
+                     .reshape(dims + (-1,))[::k, ::k, ::k]
+                     for name in ("Displacement", "Strain")]
+            origin = np.array(disp_field.GetOrigin())
+            spacing = np.array(disp_field.GetSpacing()) * k
+            field = _probeGrid(mesh, grids, origin, spacing)
             self.cell_fields.append(field)
             if self.saveFEA:
-                idisp = field.GetPointData().GetVectors()
-                bcs = np.zeros((len(self._snodes[r]), 3), float)
-                for j, node in enumerate(self._snodes[r]):
-                    d = idisp.GetTuple3(node - 1)
-                    bcs[j, 0] = d[0]
-                    bcs[j, 1] = d[1]
-                    bcs[j, 2] = d[2]
+                idisp = vtk_to_numpy(field.GetPointData().GetVectors())
+                bcs = idisp[self._snodes[r] - 1].astype(float)
                 self._bcs.append(bcs)
             idWriter = vtk.vtkXMLUnstructuredGridWriter()
             idWriter.SetFileName(
@@ -369,8 +824,62 @@ class CellMech(object):
             idWriter.SetInputData(self.cell_fields[r])
             idWriter.Write()
             if self.display:
-                self.animate(probe2.GetOutput(), r)
+                animations.append(_probeGrid(rpoly, grids, origin, spacing))
         print("Registration completed.")
+        for r, pd in enumerate(animations):
+            self.animate(pd, r)
+
+    def _antiAlias(self, img, pd):
+        """
+        Helper function called by **deformableRegistration()** that returns
+        the anti-aliased level set of a binary image reconstructed from a
+        polygonal surface. If **Use Cache** is *True* in **deformableSettings**,
+        results are stored on disk keyed by a hash of the surface, the image
+        geometry and the filter parameters, so repeated registrations of the
+        same objects skip the filter.
+
+        Parameters
+        ----------
+        img : SimpleITK Image
+            Binary image generated by **_poly2img()**.
+        pd : vtkPolyData
+            The surface **img** was generated from.
+
+        Returns
+        -------
+        SimpleITK Image
+        """
+        # the ITK defaults, passed explicitly so they are part of the cache key
+        maxRMSError = 0.07
+        iterations = 1000
+        if not self.deformableSettings.get('Use Cache', False):
+            return sitk.AntiAliasBinary(img, maxRMSError, iterations)
+        polys = pd.GetPolys()
+        key = hashlib.blake2b(
+            vtk_to_numpy(pd.GetPoints().GetData()).tobytes())
+        key.update(vtk_to_numpy(polys.GetOffsetsArray()).tobytes())
+        key.update(vtk_to_numpy(polys.GetConnectivityArray()).tobytes())
+        key.update(np.array(img.GetSpacing() + img.GetOrigin() +
+                            img.GetSize() + img.GetDirection() +
+                            (maxRMSError, iterations), np.float64).tobytes())
+        cache_dir = os.path.join(os.path.expanduser('~'),
+                                 '.pyCellAnalyst_cache')
+        filename = os.path.join(cache_dir, key.hexdigest() + '.nii')
+        if os.path.isfile(filename):
+            return sitk.ReadImage(filename)
+        aimg = sitk.AntiAliasBinary(img, maxRMSError, iterations)
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a unique file and move it into place, so a concurrent or
+        # interrupted run never leaves a partial cache entry behind
+        fd, tmpname = tempfile.mkstemp(suffix='.nii', dir=cache_dir)
+        os.close(fd)
+        try:
+            sitk.WriteImage(aimg, tmpname)
+            os.replace(tmpname, filename)
+        except Exception:
+            os.remove(tmpname)
+            raise
+        return aimg
 
     def _getECMstrain(self):
         """
@@ -389,13 +898,14 @@ class CellMech(object):
         ecm_strain
         """
         #get the ECM strain
-        rc = np.array(self.rcentroids)
-        dc = np.array(self.dcentroids)
+        rc = np.ascontiguousarray(self.rcentroids, dtype=np.float64)
+        dc = self.dcentroids
         if rc.shape[0] < 4:
             print(("WARNING: There are less than 4 objects in the space; "
                    "therefore, tissue strain was not calculated."))
             return
-        da = numpy_to_vtk(rc)
+        #zero-copy; rc stays referenced for the lifetime of the points
+        da = numpy_to_vtk(rc, deep=False, array_type=vtk.VTK_DOUBLE)
         p = vtk.vtkPoints()
         p.SetData(da)
         pd = vtk.vtkPolyData()
@@ -414,140 +924,11 @@ class CellMech(object):
             btet = np.argmin(abs(mq - 1.0))
         except:
             return
-        idlist = tet.GetOutput().GetCell(btet).GetPointIds()
-        P = np.zeros((4, 3), float)
-        p = np.zeros((4, 3), float)
-        for i in range(idlist.GetNumberOfIds()):
-            P[i, :] = rc[idlist.GetId(i), :]
-            p[i, :] = dc[idlist.GetId(i), :]
-        X = np.array([P[1, :] - P[0, :],
-                      P[2, :] - P[0, :],
-                      P[3, :] - P[0, :],
-                      P[3, :] - P[1, :],
-                      P[3, :] - P[2, :],
-                      P[2, :] - P[1, :]], float)
-
-        x = np.array([p[1, :] - p[0, :],
-                      p[2, :] - p[0, :],
-                      p[3, :] - p[0, :],
-                      p[3, :] - p[1, :],
-                      p[3, :] - p[2, :],
-                      p[2, :] - p[1, :]], float)
-
-        #assemble the system
-        dX = np.zeros((6, 6), float)
-        ds = np.zeros((6, 1), float)
-        for i in range(6):
-            dX[i, 0] = 2 * X[i, 0] ** 2
-            dX[i, 1] = 2 * X[i, 1] ** 2
-            dX[i, 2] = 2 * X[i, 2] ** 2
-            dX[i, 3] = 4 * X[i, 0] * X[i, 1]
-            dX[i, 4] = 4 * X[i, 0] * X[i, 2]
-            dX[i, 5] = 4 * X[i, 1] * X[i, 2]
-
-            ds[i, 0] = np.linalg.norm(
-                x[i, :]) ** 2 - np.linalg.norm(X[i, :]) ** 2
-
-        E = np.linalg.solve(dX, ds)
-        E = np.array([[E[0, 0], E[3, 0], E[4, 0]],
-                      [E[3, 0], E[1, 0], E[5, 0]],
-                      [E[4, 0], E[5, 0], E[2, 0]]], float)
-        self.ecm_strain = E
-
-    def _make3Dmesh(self, filename, frame, vConst):
-        """
-        Generates a 3-D tetrahedral mesh using tetmesh module build on CGAL.
-        These meshes are then used to determine the object's volume, centroid,
-        and the axes of the ellipsoid that has equivalent principal moments of
-        inertia.
-
-        Parameters
-        ----------
-        filename : str
-            The path and filename of the STL surface currently being analyzed. This
-            is necessary since MeshPy has to read the STL from disk in its native format.
-        frame : str
-            Indicates the curent state, 'MATERIAL' or 'SPATIAL'.
-
-        Returns
-        -------
-        **if frame=='MATERIAL'**
-            * rmeshes
-            * rcentroids
-            * rvols
-            * raxes
-        **else**
-            * dcentroids
-            * dvols
-            * daxes
-        """
-        vConst /= 50000.0
-        edgeSize = (vConst*12/np.sqrt(2)) ** (old_div(1.,3.))
-        m = mesh.Mesher(inputname=filename,
-                        outputname="tmp.vtu",
-                        facetAngle=30.0,
-                        facetDistance=0.1,
-                        edgeLength=edgeSize,
-                        edgeRatio=1.3)
-        m.makeMesh()
-
-        gridReader = vtk.vtkXMLUnstructuredGridReader()
-        gridReader.SetFileName("tmp.vtu")
-        gridReader.Update()
-        vtkMesh = gridReader.GetOutput()
-        nodes = vtk_to_numpy(vtkMesh.GetPoints().GetData())
-        elements = vtk_to_numpy(vtkMesh.GetCells().GetData()).reshape(
-            (vtkMesh.GetNumberOfCells(), 5))[:,1:]
-        vertex_type = vtk_to_numpy(vtkMesh.GetPointData().GetArray("Vertex Type"))
-        s_nodes = np.argwhere(vertex_type==1).ravel()
-
-        n1 = nodes[elements[:, 0], :]
-        n2 = nodes[elements[:, 1], :]
-        n3 = nodes[elements[:, 2], :]
-        n4 = nodes[elements[:, 3], :]
-        tetraCents = old_div((n1 + n2 + n3 + n4), 4.0)
-        e1 = n4 - n1
-        e2 = n3 - n1
-        e3 = n2 - n1
-        tetraVols = old_div(np.einsum('...j,...j',
-                              e1, np.cross(e2, e3, axis=1)), 6.0)
-        tetraVols = np.abs(tetraVols.ravel())
-
-        totalVol = np.sum(tetraVols)
-        centroid = np.sum(tetraVols[:, None] / totalVol * tetraCents, axis=0)
-        tetraCents -= centroid
-
-        I = np.r_[tetraCents[:, 1] ** 2 + tetraCents[:, 2] ** 2,
-                  -tetraCents[:, 0] * tetraCents[:, 1],
-                  -tetraCents[:, 0] * tetraCents[:, 2],
-                  tetraCents[:, 0] ** 2 + tetraCents[:, 2] ** 2,
-                  -tetraCents[:, 1] * tetraCents[:, 2],
-                  tetraCents[:, 0] ** 2 + tetraCents[:, 1] ** 2]
-        I = np.reshape(I, (tetraVols.size, 6), order='F')
-        I *= tetraVols[:, None]
-        I = np.sum(I, axis=0)
-        I = np.array([[I[0], I[1], I[2]],
-                      [I[1], I[3], I[4]],
-                      [I[2], I[4], I[5]]])
-        w, v = np.linalg.eigh(I)
-        order = np.argsort(w)
-        w = w[order]
-        v = v[order]
-        r_major = np.sqrt(5 * (w[1] + w[2] - w[0]) / (2 * totalVol))
-        r_middle = np.sqrt(5 * (w[0] - w[1] + w[2]) / (2 * totalVol))
-        r_minor = np.sqrt(5 * (w[0] + w[1] - w[2]) / (2 * totalVol))
-        if frame == 'MATERIAL':
-            self.rmeshes.append(vtkMesh)
-            self._snodes.append((s_nodes + 1).tolist())
-            self._elements.append((elements + 1).tolist())
-            self._nodes.append(nodes.tolist())
-            self.raxes.append([r_major, r_middle, r_minor])
-            self.rcentroids.append(centroid)
-            self.rvols.append(totalVol)
-        else:
-            self.daxes.append([r_major, r_middle, r_minor])
-            self.dcentroids.append(centroid)
-            self.dvols.append(totalVol)
+        ids = vtk_to_numpy(tet.GetOutput().GetCells()
+                           .GetConnectivityArray()).reshape(-1, 4)[btet]
+        P = rc[ids]
+        p = dc[ids]
+        self.ecm_strain = _tetStrain(P, p)
 
     def _poly2img(self, ind):
         """
@@ -565,9 +946,9 @@ class CellMech(object):
         -------
             (Reference Image, Deformed Image, Tranformed Reference Surface)
         """
-        dim = int(np.ceil(old_div(1.0, self.deformableSettings['Precision']))) + 10
-        rpoly = vtk.vtkPolyData()
-        rpoly.DeepCopy(self.rsurfs[ind])
+        dim = int(np.ceil(1.0 / self.deformableSettings['Precision'])) + 10
+        # the surfaces are only read, so no copies are needed
+        rpoly = self.rsurfs[ind]
         dpoly = self.dsurfs[ind]
         if self.rigidInitial:
             rot = vtk.vtkTransformPolyDataFilter()
@@ -589,53 +970,35 @@ class CellMech(object):
             spacing[i] = (np.max([rspan, dspan])
                           * self.deformableSettings['Precision'])
 
+        half = dim / 2.0
+        spacing = [float(sp) for sp in spacing]
+        extent = (0, dim - 1, 0, dim - 1, 0, dim - 1)
         imgs = []
-        half = old_div(float(dim), 2.0)
-        for i in range(2):
-            arr = np.ones((dim, dim, dim), np.uint8)
-            arr2img = vti.vtkImageImportFromArray()
-            arr2img.SetDataSpacing(spacing)
-            arr2img.SetDataExtent((0, dim - 1, 0, dim - 1, 0, dim - 1))
-            arr2img.SetArray(arr)
-            arr2img.Update()
-            if i == 0:
-                rimg = arr2img.GetOutput()
-                rimg.SetOrigin((np.mean(rbounds[0:2]) -
-                                half * spacing[0] + old_div(spacing[0], 2),
-                                np.mean(rbounds[2:4]) -
-                                half * spacing[1] + old_div(spacing[1], 2),
-                                np.mean(rbounds[4:]) -
-                                half * spacing[2] + old_div(spacing[2], 2)))
-            else:
-                dimg = arr2img.GetOutput()
-                dimg.SetOrigin((np.mean(dbounds[0:2]) -
-                                half * spacing[0] + old_div(spacing[0], 2),
-                                np.mean(dbounds[2:4]) -
-                                half * spacing[1] + old_div(spacing[1], 2),
-                                np.mean(dbounds[4:]) -
-                                half * spacing[2] + old_div(spacing[2], 2)))
-        imgs = []
-        for (pd, img) in [(rpoly, rimg), (dpoly, dimg)]:
+        for (pd, bounds) in [(rpoly, rbounds), (dpoly, dbounds)]:
+            origin = [float(np.mean(bounds[2 * j:2 * j + 2])) -
+                      half * spacing[j] + spacing[j] / 2.0
+                      for j in range(3)]
             pol2stenc = vtk.vtkPolyDataToImageStencil()
             pol2stenc.SetInputData(pd)
-            pol2stenc.SetOutputOrigin(img.GetOrigin())
-            pol2stenc.SetOutputSpacing(img.GetSpacing())
-            pol2stenc.SetOutputWholeExtent(img.GetExtent())
+            pol2stenc.SetOutputOrigin(origin)
+            pol2stenc.SetOutputSpacing(spacing)
+            pol2stenc.SetOutputWholeExtent(extent)
             pol2stenc.SetTolerance(0.0001)
-            pol2stenc.Update()
-
-            imgstenc = vtk.vtkImageStencil()
-            imgstenc.SetInputData(img)
-            imgstenc.SetStencilConnection(pol2stenc.GetOutputPort())
-            imgstenc.ReverseStencilOff()
-            imgstenc.SetBackgroundValue(0)
-            imgstenc.Update()
-
-            arr = vtk_to_numpy(imgstenc.GetOutput().GetPointData().GetArray(0))
-            arr = arr.reshape(dim, dim, dim)
-            itk_img = sitk.GetImageFromArray(arr)
-            itk_img.SetSpacing(img.GetSpacing())
-            itk_img.SetOrigin(img.GetOrigin())
+
+            # write the binary mask directly instead of stenciling
+            # an image of ones
+            stenc2img = vtk.vtkImageStencilToImage()
+            stenc2img.SetInputConnection(pol2stenc.GetOutputPort())
+            stenc2img.SetInsideValue(1)
+            stenc2img.SetOutsideValue(0)
+            stenc2img.SetOutputScalarTypeToUnsignedChar()
+            stenc2img.Update()
+
+            arr = vtk_to_numpy(
+                stenc2img.GetOutput().GetPointData().GetScalars())
+            itk_img = sitk.GetImageFromArray(arr.reshape(dim, dim, dim))
+            itk_img.SetSpacing(spacing)
+            itk_img.SetOrigin(origin)
             imgs.append(itk_img)
         return (imgs[0], imgs[1], rpoly)
 
@@ -698,14 +1061,17 @@ class CellMech(object):
                     calc.SetFunction(
                         "%s * 0.1 * %f" % (names[k], self.timer_count + 1))
                     calc.Update()
-                    mapper = vtk.vtkPolyDataMapper()
+                    # reuse the mapper rather than building a new one, but
+                    # set the range of its lookup table and hand it to the
+                    # scalar bar, so the bar shows this frame's range even
+                    # if it is drawn before the mapper
+                    srange = calc.GetOutput().GetScalarRange()
+                    mapper = a.GetMapper()
                     mapper.SetInputData(calc.GetOutput())
-                    mapper.SetScalarRange(calc.GetOutput().GetScalarRange())
-                    mapper.SetScalarModeToUsePointData()
-                    mapper.SetColorModeToMapScalars()
-                    mapper.Update()
-                    a.SetMapper(mapper)
-                    cb.scalar_bars[k].SetLookupTable(mapper.GetLookupTable())
+                    mapper.SetScalarRange(srange)
+                    lut = mapper.GetLookupTable()
+                    lut.SetRange(srange)
+                    self.scalar_bars[k].SetLookupTable(lut)
 
                 iren = obj
                 iren.GetRenderWindow().Render()
@@ -832,7 +1198,7 @@ class CellMech(object):
             renderer.AddActor2D(scalar_bar)
             renderer.AddActor(triad)
             renderer.ResetCamera()
-            renwin.Render()
+        renwin.Render()
 
         iren.AddObserver('TimerEvent', cb.execute)
         iren.AddObserver('KeyPressEvent', cb.Keypress)
@@ -408,10 +408,12 @@ class Application(Frame):
 
             mesh = febio.MeshDef()
             # would be good to vectorize these
-            for i, e in enumerate(self.data[filename]['elements']):
+            for i, e in enumerate(np.asarray(
+                    self.data[filename]['elements']).tolist()):
                 mesh.elements.append(['tet4', i + 1] + e)
 
-            for i, n in enumerate(self.data[filename]['nodes']):
+            for i, n in enumerate(np.asarray(
+                    self.data[filename]['nodes']).tolist()):
                 mesh.nodes.append([i + 1] + n)
 
             mesh.addElementSet(setname='cell',
@@ -526,13 +528,13 @@ class Application(Frame):
             boundary = febio.Boundary(steps=1)
             for i, bc in enumerate(self.data[filename]['boundary conditions']):
                 boundary.addPrescribed(
-                    step=0, nodeid=self.data[filename]['surfaces'][i],
+                    step=0, nodeid=int(self.data[filename]['surfaces'][i]),
                     dof='x', lc='1', scale=str(bc[0]))
                 boundary.addPrescribed(
-                    step=0, nodeid=self.data[filename]['surfaces'][i],
+                    step=0, nodeid=int(self.data[filename]['surfaces'][i]),
                     dof='y', lc='1', scale=str(bc[1]))
                 boundary.addPrescribed(
-                    step=0, nodeid=self.data[filename]['surfaces'][i],
+                    step=0, nodeid=int(self.data[filename]['surfaces'][i]),
                     dof='z', lc='1', scale=str(bc[2]))
 
             model.addBoundary(boundary=boundary)
@@ -1,20 +1,88 @@
 from __future__ import print_function
 from __future__ import division
-from builtins import str
-from builtins import range
-from builtins import object
-from past.utils import old_div
 import os
 import re
-import string
 import warnings
 import vtk
 import fnmatch
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from scipy.ndimage import find_objects
 from vtk.util import vtkImageImportFromArray as vti
-from sklearn import (svm, preprocessing)
 import SimpleITK as sitk
 
+#trailing slice number of a TIFF file name, e.g. 'stack_012.tif'
+_TIF_NUM_RE = re.compile(r'([0-9]+)\.tif')
+
+
+def _touchesBorder(bb, size):
+    """
+    Return *True* if the bounding box **bb** (index followed by size, as
+    given by LabelShapeStatisticsImageFilter) reaches either end of any
+    dimension of an image with **size**.
+    """
+    dim = len(size)
+    for j in range(dim):
+        if bb[j] <= 0 or bb[j] + bb[j + dim] >= size[j]:
+            return True
+    return False
+
+
+def _gaussianFit(points):
+    """
+    Return the mean and inverse covariance of **points**, or None if there
+    are no points. The covariance is slightly regularized so that flat or
+    very small point sets remain invertible.
+    """
+    d = points.shape[1]
+    if points.shape[0] == 0:
+        return None
+    if points.shape[0] > 1:
+        S = np.cov(points, rowvar=False)
+    else:
+        S = np.zeros((d, d))
+    S += np.eye(d) * (1e-3 * np.trace(S) / d + 1e-9)
+    return points.mean(axis=0), np.linalg.inv(S)
+
+
+def _closerTo(x, fit1, fit2):
+    """
+    Return whether each row of **x** is at least as close to the
+    distribution **fit1** as to **fit2** in terms of squared Mahalanobis
+    distance, where the fits are returned by _gaussianFit. The difference of
+    the two distances is a single quadratic form, so it is evaluated in one
+    pass over **x** without a temporary per distribution.
+    """
+    if fit2 is None:
+        return np.ones(x.shape[0], bool)
+    (m1, S1), (m2, S2) = fit1, fit2
+    A = S1 - S2
+    b = np.dot(S2, m2) - np.dot(S1, m1)
+    c = np.dot(m1, np.dot(S1, m1)) - np.dot(m2, np.dot(S2, m2))
+    return np.einsum('ij,ij->i', np.dot(x, A) + 2.0 * b, x) + c <= 0
+
+
+def _labelIndices(arr):
+    """
+    Return a dict mapping each nonzero label in **arr** to the flat indices
+    of its voxels, found with one sort instead of a scan per label.
+    """
+    flat = arr.ravel()
+    idx = np.flatnonzero(flat)
+    idx = idx[np.argsort(flat[idx], kind='stable')]
+    labels, starts = np.unique(flat[idx], return_index=True)
+    return dict(zip(labels.tolist(), np.split(idx, starts[1:])))
+
+
+def _asFloat32(img):
+    """
+    Cast **img** to sitkFloat32 unless it already is; the resampled and
+    smoothed regions usually are, so this avoids a full copy.
+    """
+    if img.GetPixelID() == sitk.sitkFloat32:
+        return img
+    return sitk.Cast(img, sitk.sitkFloat32)
+
 
 class Volume(object):
 
@@ -98,6 +166,11 @@ class Volume(object):
         If *True*, will enhance edges after smoothing using Laplacian sharpening.
     depth_adjust : bool=False, optional
         If *True*, will perform a linear correction for intensity degradation with depth.
+    equalize : bool=True, optional
+        If *True*, will perform adaptive histogram equalization on smoothed regions
+        before rescaling their intensities to [0, 1]. If *False*, the intensities are
+        only rescaled linearly over the whole region, which is much faster but does
+        not compensate for local contrast variations.
     opening : bool=True, optional
         If *True*, will perform a morphological binary opening following thresholding to
         remove spurious connections and islands. If object of interest is thin, this may
@@ -109,7 +182,8 @@ class Volume(object):
     display : bool=True, optional
         If *True*, will spawn a 3-D interactive window rendering of segmented object surfaces.
     handle_overlap : bool=True, optional
-        If *True*, overlapping segmented objects will be reclassified using a Support Vector Machine.
+        If *True*, overlapping segmented objects will be reclassified by their Mahalanobis distance
+        to the seed of each object.
     debug : bool=False, optional
         If *True*, will write additional images to disk in NifTi format for debugging purposes.
 
@@ -120,14 +194,14 @@ class Volume(object):
         input image stack.
     thresholds  : [, int, ...]
         The threshold level for each cell
-    volumes : [, float, ...]
-        List of the physical volumes of the segmented objects.
-    centroids : [,[float, float, float], ...]1
-        List of centroids of segmented objects in physical space.
+    volumes : ndarray(N)
+        The physical volumes of the segmented objects.
+    centroids : ndarray(N, 3)
+        The centroids of segmented objects in physical space.
     surfaces : [,vtkPolyData, ...]
         List containing VTK STL objects.
-    dimensions : [,[float, float, float],...]
-        List containing the ellipsoid axis lengths of segmented objects.
+    dimensions : ndarray(N, 3)
+        The ellipsoid axis lengths of segmented objects.
         These are determined from the segmented binary images. It is recommended
         to use the values calculated from a 3-D mesh in the **CellMech** class.
     """
@@ -145,6 +219,7 @@ class Volume(object):
                  bright=False,
                  enhance_edge=False,
                  depth_adjust=False,
+                 equalize=True,
                  display=True,
                  handle_overlap=True,
                  debug=False,
@@ -172,6 +247,7 @@ class Volume(object):
         self.bright = bright
         self.enhance_edge = enhance_edge
         self.depth_adjust = depth_adjust
+        self.equalize = equalize
         self.debug = debug
         try:
             if self.debug:
@@ -260,18 +336,17 @@ class Volume(object):
 
         if ftype == "*.tif*":
             if len(files) > 1:
-                counter = [re.search("[0-9]*\.tif", f).group() for f in files]
-                for i, c in enumerate(counter):
-                    counter[i] = int(c.replace('.tif', ''))
-                files = np.array(files, dtype=object)
-                sorter = np.argsort(counter)
-                files = files[sorter]
-                img = []
-                for fname in files:
-                    filename = str(
-                        os.path.normpath(self._vol_dir + os.sep + fname))
-                    img.append(sitk.ReadImage(filename, sitk.sitkFloat32))
-                self._img = sitk.RescaleIntensity(sitk.JoinSeries(img), 0.0, 1.0)
+                counter = np.fromiter(
+                    (int(_TIF_NUM_RE.search(f).group(1)) for f in files),
+                    dtype=np.int64, count=len(files))
+                files = np.array(files, dtype=object)[np.argsort(counter)]
+                #read the whole series straight into one 3-D buffer
+                reader = sitk.ImageSeriesReader()
+                reader.SetFileNames(
+                    [str(os.path.normpath(self._vol_dir + os.sep + fname))
+                     for fname in files])
+                reader.SetOutputPixelType(sitk.sitkFloat32)
+                self._img = sitk.RescaleIntensity(reader.Execute(), 0.0, 1.0)
                 print(("\nImported 3D image stack ranging from {:s} to {:s}"
                       .format(files[0], files[-1])))
             else:
@@ -288,38 +363,21 @@ class Volume(object):
         self._img.SetSpacing(self._pixel_dim)
 
     def smoothRegion(self, img):
-        img = sitk.Cast(img, sitk.sitkFloat32)
+        img = _asFloat32(img)
 
         if self.smoothing_method == 'None':
             pass
         elif self.smoothing_method == 'Gaussian':
-            parameters = {'sigma': 0.5}
-            for p in list(self.smoothing_parameters.keys()):
-                try:
-                    parameters[p] = self.smoothing_parameters[p]
-                except:
-                    raise SystemExit("{:s} is not a parameter of {:s}"
-                                     .format(p, self.smoothing_method))
+            parameters = self._mergeParameters({'sigma': 0.5})
             img = sitk.DiscreteGaussian(img, variance=parameters['sigma'])
 
         elif self.smoothing_method == 'Median':
-            parameters = {'radius': (1, 1, 1)}
-            for p in list(self.smoothing_parameters.keys()):
-                try:
-                    parameters[p] = self.smoothing_parameters[p]
-                except:
-                    raise SystemExit("{:s} is not a parameter of {:s}"
-                                     .format(p, self.smoothing_method))
+            parameters = self._mergeParameters({'radius': (1, 1, 1)})
             img = sitk.Median(img, radius=parameters['radius'])
 
         elif self.smoothing_method == 'Curvature Diffusion':
-            parameters = {'iterations': 10, 'conductance': 9}
-            for p in list(self.smoothing_parameters.keys()):
-                try:
-                    parameters[p] = self.smoothing_parameters[p]
-                except:
-                    raise SystemExit("{:s} is not a parameter of {:s}"
-                                     .format(p, self.smoothing_method))
+            parameters = self._mergeParameters({'iterations': 10,
+                                                'conductance': 9})
             smooth = sitk.CurvatureAnisotropicDiffusionImageFilter()
             smooth.EstimateOptimalTimeStep(img)
             smooth.SetNumberOfIterations(parameters['iterations'])
@@ -327,15 +385,9 @@ class Volume(object):
             img = smooth.Execute(img)
 
         elif self.smoothing_method == 'Gradient Diffusion':
-            parameters = {'iterations': 10,
-                          'conductance': 9,
-                          'time step': 0.01}
-            for p in list(self.smoothing_parameters.keys()):
-                try:
-                    parameters[p] = self.smoothing_parameters[p]
-                except:
-                    raise SystemExit("{:s} is not a parameter of {:s}"
-                                     .format(p, self.smoothing_method))
+            parameters = self._mergeParameters({'iterations': 10,
+                                                'conductance': 9,
+                                                'time step': 0.01})
             smooth = sitk.GradientAnisotropicDiffusionImageFilter()
             smooth.SetNumberOfIterations(parameters['iterations'])
             smooth.SetConductanceParameter(parameters['conductance'])
@@ -343,41 +395,32 @@ class Volume(object):
             img = smooth.Execute(img)
 
         elif self.smoothing_method == 'Bilateral':
-            parameters = {'domainSigma': 1.5,
-                          'rangeSigma': 10.0,
-                          'samples': 100}
-            for p in list(self.smoothing_parameters.keys()):
-                try:
-                    parameters[p] = self.smoothing_parameters[p]
-                except:
-                    raise SystemExit("{:s} is not a parameter of {:s}"
-                                     .format(p, self.smoothing_method))
-            img = sitk.Cast(img, sitk.sitkUInt8)
+            parameters = self._mergeParameters({'domainSigma': 1.5,
+                                                'rangeSigma': 10.0,
+                                                'samples': 100})
+            #filter the float image directly; rangeSigma is given in 8-bit
+            #grey levels while the stack is rescaled to [0, 1]
             img = sitk.Bilateral(
                 img,
                 domainSigma=parameters['domainSigma'],
-                rangeSigma=parameters['rangeSigma'],
+                rangeSigma=parameters['rangeSigma'] / 255.0,
                 numberOfRangeGaussianSamples=parameters['samples'])
 
         elif self.smoothing_method == 'Patch-based':
-            parameters = {'radius': 4,
-                          'iterations': 10,
-                          'patches': 20,
-                          'noise model': 3}
+            parameters = self._mergeParameters({'radius': 4,
+                                                'iterations': 10,
+                                                'patches': 20,
+                                                'noise model': 'poisson'})
             noise_models = {'nomodel': 0,
                             'gaussian': 1,
                             'rician': 2,
                             'poisson': 3}
-            for p in list(self.smoothing_parameters.keys()):
-                try:
-                    if p == 'noise model':
-                        parameters[p] = noise_models[
-                            self.smoothing_parameters[p]]
-                    else:
-                        parameters[p] = self.smoothing_parameters[p]
-                except:
-                    raise SystemExit("{:s} is not a parameter of {:s}"
-                                     .format(p, self.smoothing_method))
+            try:
+                parameters['noise model'] = noise_models[
+                    parameters['noise model']]
+            except KeyError:
+                raise SystemExit("{} is not a supported noise model"
+                                 .format(parameters['noise model']))
 
             smooth = sitk.PatchBasedDenoisingImageFilter()
             smooth.KernelBandwidthEstimationOn()
@@ -411,35 +454,127 @@ class Volume(object):
             img = sitk.InvertIntensity(img)
         # replace border pixel values with average of border slices
         img = self._flattenBorder(img)
-        img = sitk.AdaptiveHistogramEqualization(img, radius=[int(s / 4) for s in img.GetSize()])
+        if self.equalize:
+            img = sitk.AdaptiveHistogramEqualization(img, radius=[int(s / 4) for s in img.GetSize()])
 
         return sitk.RescaleIntensity(img, 0.0, 1.0)
 
-    def _getMinMax(self, img):
-        mm = sitk.MinimumMaximumImageFilter()
-        mm.Execute(img)
-        return (mm.GetMinimum(), mm.GetMaximum())
+    def _mergeParameters(self, defaults):
+        """
+        Update the **defaults** of the current smoothing method with the
+        user's **smoothing_parameters**, rejecting any unknown keys.
+        """
+        unknown = set(self.smoothing_parameters) - set(defaults)
+        if unknown:
+            raise SystemExit("{:s} is not a parameter of {:s}"
+                             .format(", ".join(sorted(unknown)),
+                                     self.smoothing_method))
+        defaults.update(self.smoothing_parameters)
+        return defaults
+
+    def _getMin(self, img):
+        #reduce over a view of the pixel buffer; no copy is made
+        return float(np.min(sitk.GetArrayViewFromImage(img)))
+
+    def _getMax(self, img):
+        #reduce over a view of the pixel buffer; no copy is made
+        return float(np.max(sitk.GetArrayViewFromImage(img)))
 
     def _getLabelShape(self, img):
         ls = sitk.LabelShapeStatisticsImageFilter()
         ls.Execute(img)
         labels = ls.GetLabels()
-        labelshape = {'volume': [],
-                      'centroid': [],
-                      'ellipsoid diameters': [],
-                      'ellipsoid axes': [],
-                      'bounding box': [],
-                      'border size': []}
-        for l in labels:
-            labelshape['volume'].append(ls.GetPhysicalSize(l))
-            labelshape['centroid'].append(ls.GetCentroid(l))
-            labelshape['ellipsoid diameters'].append(
+        n = len(labels)
+        dim = img.GetDimension()
+        #one preallocated array per shape feature with a row per label
+        labelshape = {'volume': np.empty(n),
+                      'centroid': np.empty((n, dim)),
+                      'ellipsoid diameters': np.empty((n, dim)),
+                      'ellipsoid axes': np.empty((n, dim * dim)),
+                      'bounding box': np.empty((n, 2 * dim), np.int64),
+                      'border size': np.empty(n)}
+        for k, l in enumerate(labels):
+            labelshape['volume'][k] = ls.GetPhysicalSize(l)
+            labelshape['centroid'][k] = ls.GetCentroid(l)
+            labelshape['ellipsoid diameters'][k] = (
                 ls.GetEquivalentEllipsoidDiameter(l))
-            labelshape['ellipsoid axes'].append(ls.GetPrincipalAxes(l))
-            labelshape['bounding box'].append(ls.GetBoundingBox(l))
-            labelshape['border size'].append(ls.GetPerimeterOnBorder(l))
+            labelshape['ellipsoid axes'][k] = ls.GetPrincipalAxes(l)
+            labelshape['bounding box'][k] = ls.GetBoundingBox(l)
+            labelshape['border size'][k] = ls.GetPerimeterOnBorder(l)
         return labelshape
 
+    def _interiorComponent(self, seed):
+        """
+        Return the connected component of the binary **seed** that lies
+        least on the border of the region.
+        """
+        labels = sitk.ConnectedComponent(seed)
+        #only the border size is needed, so skip the costly shape features
+        ls = sitk.LabelShapeStatisticsImageFilter()
+        ls.ComputePerimeterOff()
+        ls.ComputeFeretDiameterOff()
+        ls.Execute(labels)
+        ids = ls.GetLabels()
+        border = [ls.GetPerimeterOnBorder(l) for l in ids]
+        return labels == ids[int(np.argmin(border))]
+
+    def _addRegionLabel(self, cells, label, index, shared):
+        """
+        Add **label**, an image on the grid of a region of interest
+        starting at voxel **index**, in place to the label array **cells**.
+        Only the voxels of the region are touched, so overlaps with
+        previously segmented objects show up as summed labels. If
+        **shared** is not None, the overlapping voxels are also marked in
+        this boolean array so they can be reclassified afterwards.
+        """
+        arr = sitk.GetArrayViewFromImage(label)
+        #array axes are ordered (z, y, x), the reverse of the index
+        region = tuple(slice(int(o), int(o) + n)
+                       for o, n in zip(index[::-1], arr.shape))
+        block = cells[region]
+        if shared is not None:
+            shared[region] |= (block != 0) & (arr != 0)
+        block += arr.astype(cells.dtype, copy=False)
+
+    def _labelImage(self, cells):
+        """
+        Wrap the label array **cells** as an image with the geometry of
+        the image stack.
+        """
+        img = sitk.GetImageFromArray(cells)
+        img.CopyInformation(self._img)
+        return img
+
+    def _smoothROI(self, region):
+        """
+        Extract **region** from the image, optionally remove bright spots,
+        and smooth it.
+        """
+        if self._img.GetDimension() == 3:
+            roi = sitk.RegionOfInterest(self._img, region[3:], region[0:3])
+        else:
+            roi = sitk.RegionOfInterest(self._img, region[3:5],
+                                        region[0:2])
+        #Remove bright spots if bright=True
+        if self.bright:
+            a = sitk.GetArrayFromImage(roi)
+            med = sitk.Median(roi, (6, 6, 6))
+            b = sitk.GetArrayViewFromImage(med)
+            top = np.percentile(a.ravel(), 98)
+            #replace only voxels in 98th or higher percentile
+            #with median smoothed value
+            bright = a > top
+            a[bright] = b[bright]
+            a = sitk.GetImageFromArray(a)
+            a.SetSpacing(roi.GetSpacing())
+            a.SetOrigin(roi.GetOrigin())
+            a.SetDirection(roi.GetDirection())
+            roi = a
+
+        if self.two_dim:
+            return self.smooth2D(roi)
+        return self.smoothRegion(roi)
+
     def thresholdSegmentation(self, method='Percentage',
                               adaptive=True, ratio=0.4):
         r"""
@@ -482,44 +617,32 @@ class Volume(object):
             raise SystemExit("{:s} is not a supported threshold method."
                              .format(method))
         dimension = self._img.GetDimension()
-        for i, region in enumerate(self._regions):
-            if dimension == 3:
-                roi = sitk.RegionOfInterest(self._img, region[3:], region[0:3])
-            else:
-                self._pixel_dim = self._pixel_dim[0:2]
-                roi = sitk.RegionOfInterest(self._img, region[3:5],
-                                            region[0:2])
-            #Remove bright spots if bright=True
-            if self.bright:
-                a = sitk.GetArrayFromImage(roi)
-                b = sitk.GetArrayFromImage(sitk.Median(roi, (6, 6, 6)))
-                top = np.percentile(a.ravel(), 98)
-                #replace only voxels in 98th or higher percentile
-                #with median smoothed value
-                a[a > top] = b[a > top]
-                a = sitk.GetImageFromArray(a)
-                a.SetSpacing(roi.GetSpacing())
-                a.SetOrigin(roi.GetOrigin())
-                a.SetDirection(roi.GetDirection())
-                roi = a
-
-            if self.two_dim:
-                simg = self.smooth2D(roi)
-            else:
-                simg = self.smoothRegion(roi)
-
+        if dimension == 2:
+            self._pixel_dim = self._pixel_dim[0:2]
+        #smoothing of each region is independent and SimpleITK releases
+        #the GIL while filtering, so smooth all regions concurrently
+        with ThreadPoolExecutor() as pool:
+            smoothed = list(pool.map(self._smoothROI, self._regions))
+        #accumulate the labels of all regions in one array
+        cells = sitk.GetArrayFromImage(self.cells)
+        #voxels claimed by more than one object and the claim of each object
+        shared = np.zeros(cells.shape, bool) if self.handle_overlap else None
+        claims = []
+        #the voxel size is the same for every region
+        pixel_dim = np.array(self._pixel_dim, float)
+        for i, (region, simg) in enumerate(zip(self._regions, smoothed)):
             print("\n------------------")
             print(("Segmenting Cell {:d}".format(i + 1)))
             print("------------------\n")
 
             if method == 'Percentage':
-                t = self._getMinMax(simg)[1]
+                t = self._getMax(simg)
 
                 if self.two_dim:
                     seg, thigh, tlow, tlist = self.threshold2D(simg, "Percentage", ratio)
                 else:
                     t *= ratio
-                    seg = sitk.BinaryThreshold(simg, t, 1e7)
+                    seg = sitk.GreaterEqual(simg, t)
 
                 if self.two_dim:
                     print(("... Threshold using {:s} method ranged: "
@@ -580,54 +703,63 @@ class Volume(object):
 
             if adaptive and not(self.two_dim):
                 newt = float(np.copy(t))
-                if dimension == 3:
-                    region_bnds = [(0, region[3]), (0, region[4])]
-                else:
-                    region_bnds = [(0, region[2]), (0, region[3])]
-
+                #only centroids, sizes and bounding boxes are needed here
+                #so skip the perimeter and other derived shape features
+                ls = sitk.LabelShapeStatisticsImageFilter()
+                ls.ComputePerimeterOff()
+                ls.ComputeFeretDiameterOff()
+                ls.ComputeOrientedBoundingBoxOff()
+                #the loop repeats the same filters with only the threshold
+                #changing, so build each filter once and re-execute it
+                threshold = sitk.GreaterEqualImageFilter()
+                opening = sitk.BinaryMorphologicalOpeningImageFilter()
+                opening.SetKernelRadius(1)
+                holefill = sitk.VotingBinaryIterativeHoleFillingImageFilter()
+                components = sitk.ConnectedComponentImageFilter()
+                seg_size = seg.GetSize()
                 cnt = 0
                 while True:
                     if self.opening:
                         #Opening (Erosion/Dilation) step to remove islands
                         #smaller than 1 voxels in radius
-                        seg = sitk.BinaryMorphologicalOpening(seg, 1)
+                        seg = opening.Execute(seg)
                     if self.fillholes:
-                        seg = sitk.VotingBinaryIterativeHoleFilling(seg)
+                        seg = holefill.Execute(seg)
                     #Get connected regions
-                    r = sitk.ConnectedComponent(seg)
-                    labelstats = self._getLabelShape(r)
-                    d = 1e7
-                    region_cent = old_div(np.array(list(seg.GetSize()), float), 2.0)
-                    region_cent *= np.array(self._pixel_dim)
-                    region_cent += np.array(list(seg.GetOrigin()), float)
+                    r = components.Execute(seg)
                     if cnt == 0:
-                        for l, c in enumerate(labelstats['centroid']):
-                            dist = np.linalg.norm(np.array(c, float) - region_cent)
-                            if dist < d:
-                                d = dist
-                                label = l + 1
-                        mask = r==label
+                        ls.Execute(r)
+                        labels = ls.GetLabels()
+                        # if no label here, the threshold is too high and
+                        # there is no object to claim for this cell
+                        if len(labels) == 0:
+                            raise SystemExit(
+                                ("No object was found for Cell {:d} at a "
+                                 "threshold of {:6.5f}; the threshold is too "
+                                 "high.".format(i + 1, newt)))
+                        region_cent = np.array(seg_size, float) / 2.0
+                        region_cent *= pixel_dim
+                        region_cent += np.array(seg.GetOrigin(), float)
+                        cents = np.array([ls.GetCentroid(l) for l in labels])
+                        label = labels[int(np.argmin(
+                            np.linalg.norm(cents - region_cent, axis=1)))]
+                        mask = r == label
                     else:
-                        tmp = sitk.Mask(r, mask)
-                        sitk.WriteImage(mask, "mask{:d}.nii".format(i+1))
-                        stats = self._getLabelShape(tmp)
-                        try:
-                            label = np.argmax(stats["volume"]) + 1
-                        except:
+                        ls.Execute(sitk.Mask(r, mask))
+                        labels = ls.GetLabels()
+                        if len(labels) == 0:
+                            # threshold adjusted too much so take
+                            # the previous increment
                             newt -= 0.001
-                            seg = sitk.BinaryThreshold(simg, newt, 1e7)
+                            seg = threshold.Execute(simg, newt)
                             break
+                        label = max(labels, key=ls.GetNumberOfPixels)
+                        ls.Execute(r)
                     cnt += 1
-                    # if exception here, then threshold adjusted too much
-                    # and previous increment will be taken
-                    try:
-                        bb = labelstats['bounding box'][label - 1]
-                    except:
-                        break
 
-                    if labelstats['border size'][label - 1] > 0:
+                    if _touchesBorder(ls.GetBoundingBox(label), seg_size):
                         newt += 0.001
-                        seg = sitk.BinaryThreshold(simg, newt, 1e7)
+                        seg = threshold.Execute(simg, newt)
                     else:
                         break
                 if not(newt == t):
@@ -640,31 +772,24 @@ class Volume(object):
                     #smaller than 1 voxels in radius
                     seg = sitk.VotingBinaryIterativeHoleFilling(seg)
                 if self.fillholes:
-                    seg = sitk.BinaryFillhole(seg != 0)
+                    seg = sitk.BinaryFillhole(seg, foregroundValue=1)
                 #Get connected regions
                 r = sitk.ConnectedComponent(seg)
                 labelstats = self._getLabelShape(r)
-                d = 1e7
-                region_cent = old_div(np.array(list(seg.GetSize()), float), 2.0)
-                region_cent *= np.array(self._pixel_dim)
-                region_cent += np.array(list(seg.GetOrigin()), float)
-                for l, c in enumerate(labelstats['centroid']):
-                    dist = np.linalg.norm(np.array(c, float) - region_cent)
-                    if dist < d:
-                        d = dist
-                        label = l + 1
+                region_cent = np.array(seg.GetSize(), float) / 2.0
+                region_cent *= pixel_dim
+                region_cent += np.array(seg.GetOrigin(), float)
+                label = int(np.argmin(np.linalg.norm(
+                    labelstats['centroid'] - region_cent, axis=1))) + 1
                 if self.two_dim:
                     self.thresholds.append(np.max(tlist))
                 else:
                     self.thresholds.append(t)
 
-            tmp = sitk.Image(self._img.GetSize(), sitk.sitkUInt8)
-            tmp.CopyInformation(self._img)
-            resampler = sitk.ResampleImageFilter()
-            resampler.SetReferenceImage(tmp)
-            resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-            tmp = resampler.Execute((r == label) * (i + 1))
-            self.cells = sitk.Add(self.cells, tmp)
+            #the labels are already on the region grid
+            claim = sitk.BinaryThreshold(r, label, label, i + 1, 0)
+            claims.append((region[0:dimension], claim))
+            self._addRegionLabel(cells, claim, region[0:dimension], shared)
             # scale smoothed image if independent slices option flagged
             if self.two_dim:
                 simg = self.scale2D(simg, tlist)
@@ -674,11 +799,10 @@ class Volume(object):
                                 str(os.path.normpath(
                                     self._output_dir + os.sep +
                                     "smoothed_{:03d}.nii".format(i + 1))))
-            #Test for overlap
-            if self.handle_overlap:
-                maxlabel = self._getMinMax(self.cells)[1]
-                if maxlabel > (i + 1):
-                    self.cells = self._classifyShared(i, self.cells, False)
+        #resolve all overlaps at once
+        if self.handle_overlap:
+            self._classifyShared(cells, shared, claims, False)
+        self.cells = self._labelImage(cells)
 
     def geodesicSegmentation(self,
                              upsampling=2,
@@ -749,13 +873,21 @@ class Volume(object):
         self.thresholdSegmentation(method=seed_method, ratio=ratio,
                                    adaptive=adaptive)
         dimension = self._img.GetDimension()
-        newcells = sitk.Image(self.cells.GetSize(), sitk.sitkUInt8)
-        newcells.CopyInformation(self.cells)
-        for i, region in enumerate(self._regions):
-            print("\n-------------------------------------------")
-            print(("Evolving Geodesic Active Contour for Cell {:d}"
-                  .format(i + 1)))
-            print("-------------------------------------------")
+        #accumulate the labels of all regions in one array
+        newcells = np.zeros(self.cells.GetSize()[::-1], np.uint8)
+        #voxels claimed by more than one object and the claim of each object
+        shared = np.zeros(newcells.shape, bool) if self.handle_overlap else None
+        claims = []
+        #the refined spacing only depends on the voxel size
+        newspace = [p / float(upsampling) for p in self._pixel_dim[0:2]]
+        if dimension == 3:
+            zspace = self._pixel_dim[2]
+            zratio = zspace / self._pixel_dim[0]
+
+        def evolve(i, region):
+            #regions are evolved concurrently, so messages are collected
+            #and reported once the region is done
+            report = []
             if dimension == 3:
                 seed = sitk.RegionOfInterest(self.cells,
                                              region[3:],
@@ -763,23 +895,13 @@ class Volume(object):
                 roi = self.smoothed[i]
                 #resample the Region of Interest to improve resolution of
                 #derivatives and give closer to isotropic voxels
-                zratio = old_div(self._pixel_dim[2], self._pixel_dim[0])
                 #adjust size in z to be close to isotropic and double
                 #the resolution
-                newz = int(zratio * roi.GetSize()[2]) * upsampling
-                newzspace = (old_div(float(roi.GetSize()[2]), float(newz))) * self._pixel_dim[2]
-                newx = roi.GetSize()[0] * upsampling
-                newxspace = old_div(self._pixel_dim[0], float(upsampling))
-                newy = roi.GetSize()[1] * upsampling
-                newyspace = old_div(self._pixel_dim[1], float(upsampling))
-                #Do the resampling
-                refine = sitk.ResampleImageFilter()
-                refine.SetInterpolator(sitk.sitkBSpline)
-                refine.SetSize((newx, newy, newz))
-                refine.SetOutputOrigin(roi.GetOrigin())
-                refine.SetOutputSpacing((newxspace, newyspace, newzspace))
-                refine.SetOutputDirection(roi.GetDirection())
-                simg = refine.Execute(roi)
+                size = roi.GetSize()
+                newz = int(zratio * size[2]) * upsampling
+                newzspace = float(size[2]) / float(newz) * zspace
+                newsize = (size[0] * upsampling, size[1] * upsampling, newz)
+                newspacing = newspace + [newzspace]
             else:
                 seed = sitk.RegionOfInterest(self.cells,
                                              region[3:5],
@@ -787,32 +909,27 @@ class Volume(object):
                 roi = self.smoothed[i]
                 #resample the Region of Interest to improve resolution
                 #of derivatives
-                newx = roi.GetSize()[0] * upsampling
-                newxspace = old_div(self._pixel_dim[0], float(upsampling))
-                newy = roi.GetSize()[1] * upsampling
-                newyspace = old_div(self._pixel_dim[1], float(upsampling))
-                #Do the resampling
-                refine = sitk.ResampleImageFilter()
-                refine.SetInterpolator(sitk.sitkBSpline)
-                refine.SetSize((newx, newy))
-                refine.SetOutputOrigin(roi.GetOrigin())
-                refine.SetOutputSpacing((newxspace, newyspace))
-                refine.SetOutputDirection(roi.GetDirection())
-                simg = refine.Execute(roi)
-            refine.SetInterpolator(sitk.sitkNearestNeighbor)
-            seed = refine.Execute(seed)
-            if self._getMinMax(seed)[1] < 1:
-                seed = self._replaceSeed(seed)
+                size = roi.GetSize()
+                newsize = (size[0] * upsampling, size[1] * upsampling)
+                newspacing = newspace
+            #Do the resampling; every image has a fixed interpolator, so
+            #no filter is reconfigured between images
+            def refine(img, interpolator):
+                return sitk.Resample(img, newsize, sitk.Transform(),
+                                     interpolator, roi.GetOrigin(),
+                                     newspacing, roi.GetDirection())
+
+            simg = refine(roi, sitk.sitkBSpline)
+            seed = refine(seed, sitk.sitkNearestNeighbor)
+            if self._getMax(seed) < 1:
+                seed = self._replaceSeed(seed, report)
             else:
                 #smooth the perimeter of the binary seed
                 dm = sitk.SignedMaurerDistanceMap(seed, False, False, False)
-                mindist = self._getMinMax(dm)[0]
+                mindist = self._getMin(dm)
                 #shrink seed by 20%
                 seed = dm <= 0.2 * mindist
-                labels = sitk.ConnectedComponent(seed)
-                labelstats = self._getLabelShape(labels)
-                ind = np.argmin(labelstats['border size'])
-                seed = labels == ind + 1
+                seed = self._interiorComponent(seed)
 
             if self.two_dim and dimension == 3:
                 seg = self.geodesic2D(seed, simg,
@@ -820,29 +937,22 @@ class Volume(object):
                                       upsampling, active_iterations, rms,
                                       propagation, curvature, advection)
             else:
+                #detect edges at the original resolution, which has
+                #upsampling**dimension fewer voxels, and then interpolate
+                #the edge map onto the upsampled grid
                 canny = sitk.CannyEdgeDetection(
-                    sitk.Cast(simg, sitk.sitkFloat32),
+                    _asFloat32(roi),
                     lowerThreshold=cannyLower,
                     upperThreshold=cannyUpper,
                     variance=canny_variance)
 
                 canny = sitk.InvertIntensity(canny, 1)
-                canny = sitk.Cast(canny, sitk.sitkFloat32)
-                a = sitk.GetArrayFromImage(canny)
-                if len(a.shape) == 3:
-                    ind = [np.s_[0:2, :, :], np.s_[-2:, :, :],
-                           np.s_[:, 0:2, :], np.s_[:, -2:, :],
-                           np.s_[:, :, 0:2], np.s_[:, :, -2:]]
-                else:
-                    ind = [np.s_[0:2, :], np.s_[-2:, :],
-                           np.s_[:, 0:2], np.s_[:, -2:]]
-
-                m = np.max(a.ravel())
-                for ii in ind:
-                    a[ii] = m
-                tmp = sitk.GetImageFromArray(a)
-                tmp.CopyInformation(canny)
-                canny = tmp
+                canny = _asFloat32(refine(canny, sitk.sitkLinear))
+                #set a two voxel band on the region bounds to the maximum
+                #by cropping and padding instead of copying to NumPy and back
+                band = [2] * dimension
+                canny = sitk.ConstantPad(sitk.Crop(canny, band, band),
+                                         band, band, self._getMax(canny))
 
                 if self.debug:
                     sitk.WriteImage(sitk.RescaleIntensity(simg, 0, 255),
@@ -864,35 +974,50 @@ class Volume(object):
                                                  squaredDistance=False,
                                                  useImageSpacing=True)
                 gd = sitk.GeodesicActiveContourLevelSetImageFilter()
-                gd.SetMaximumRMSError(old_div(rms, float(upsampling)))
+                gd.SetMaximumRMSError(rms / float(upsampling))
                 gd.SetNumberOfIterations(active_iterations)
                 gd.SetPropagationScaling(propagation)
                 gd.SetCurvatureScaling(curvature)
                 gd.SetAdvectionScaling(advection)
                 seg = gd.Execute(d, canny)
-                print("... Geodesic Active Contour Segmentation Completed")
-                print(("... ... Elapsed Iterations: {:d}"
-                      .format(gd.GetElapsedIterations())))
-                print(("... ... Change in RMS Error: {:.3e}"
-                      .format(gd.GetRMSChange())))
-
-            self.levelsets.append(seg)
-            seg = sitk.BinaryThreshold(seg, -1e7, 0) * (i + 1)
-            tmp = sitk.Image(self._img.GetSize(), sitk.sitkUInt8)
-            tmp.CopyInformation(self._img)
-            resampler = sitk.ResampleImageFilter()
-            resampler.SetReferenceImage(tmp)
-            resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-            tmp = resampler.Execute(seg)
+                report.append("... Geodesic Active Contour Segmentation "
+                              "Completed")
+                report.append("... ... Elapsed Iterations: {:d}"
+                              .format(gd.GetElapsedIterations()))
+                report.append("... ... Change in RMS Error: {:.3e}"
+                              .format(gd.GetRMSChange()))
+
+            #threshold straight to the cell label in a single one-sided
+            #comparison
+            b = sitk.LessEqual(seg, 0.0, 0, i + 1)
+            #resample back onto the region of interest only
+            tmp = sitk.Resample(b, roi, sitk.Transform(),
+                                sitk.sitkNearestNeighbor)
             if self.fillholes:
-                tmp = sitk.BinaryFillhole(tmp)
-            newcells = sitk.Add(newcells, tmp)
-            #Handle Overlap
-            if self.handle_overlap:
-                maxlabel = self._getMinMax(newcells)[1]
-                if maxlabel > (i + 1):
-                    newcells = self._classifyShared(i, newcells, True)
-        self.cells = newcells
+                tmp = sitk.BinaryFillhole(tmp, foregroundValue=i + 1)
+            return seg, tmp, report
+
+        #the active contours of the regions are independent and SimpleITK
+        #releases the GIL while filtering, so evolve them concurrently and
+        #only merge the results into the label image in order
+        with ThreadPoolExecutor() as pool:
+            results = list(pool.map(evolve, range(len(self._regions)),
+                                    self._regions))
+        for i, (seg, tmp, report) in enumerate(results):
+            print("\n-------------------------------------------")
+            print(("Evolving Geodesic Active Contour for Cell {:d}"
+                  .format(i + 1)))
+            print("-------------------------------------------")
+            for line in report:
+                print(line)
+            self.levelsets.append(seg)
+            claims.append((self._regions[i][0:dimension], tmp))
+            self._addRegionLabel(newcells, tmp,
+                                 self._regions[i][0:dimension], shared)
+        #Handle Overlap, all at once
+        if self.handle_overlap:
+            self._classifyShared(newcells, shared, claims, True)
+        self.cells = self._labelImage(newcells)
 
     def edgeFreeSegmentation(self,
                              upsampling=2,
@@ -902,7 +1027,8 @@ class Volume(object):
                              lambda1=1.0,
                              lambda2=1.1,
                              curvature=0.0,
-                             iterations=20):
+                             iterations=20,
+                             high_quality=False):
         """
         Performs a segmentation using the SimpleITK implementation of the
         Active Contours Without Edges method described in (Chan and Vese. 2001.)
@@ -933,42 +1059,44 @@ class Volume(object):
             ability to capture fine features.
         iterations : int=20
             The number of iterations the active contour method will conduct.
+        high_quality : bool=False
+            If true, upsample the region of interest with B-spline instead of
+            linear interpolation. The active contour smooths the image anyway,
+            so the more costly B-spline is rarely worth it.
         """
         self.active = "EdgeFree"
         self.thresholdSegmentation(method=seed_method, ratio=ratio,
                                    adaptive=adaptive)
         dimension = self._img.GetDimension()
-        newcells = sitk.Image(self.cells.GetSize(), sitk.sitkUInt8)
-        newcells.CopyInformation(self.cells)
-        for i, region in enumerate(self._regions):
-            print("\n-------------------------------------------")
-            print(("Evolving Edge-free Active Contour for Cell {:d}"
-                  .format(i + 1)))
-            print("-------------------------------------------")
+        #accumulate the labels of all regions in one array
+        newcells = np.zeros(self.cells.GetSize()[::-1], np.uint8)
+        #voxels claimed by more than one object and the claim of each object
+        shared = np.zeros(newcells.shape, bool) if self.handle_overlap else None
+        claims = []
+        #the refined spacing only depends on the voxel size
+        newspace = [p / float(upsampling) for p in self._pixel_dim[0:2]]
+        if dimension == 3:
+            zspace = self._pixel_dim[2]
+            zratio = zspace / self._pixel_dim[0]
+
+        def evolve(i, region):
+            #regions are evolved concurrently, so messages are collected
+            #and reported once the region is done
+            report = []
             if dimension == 3:
                 seed = sitk.RegionOfInterest(self.cells,
                                              region[3:],
                                              region[0:3])
                 roi = self.smoothed[i]
-                #resample the Region of Interest to improve resolution
-                #of derivatives and give closer to isotropic voxels
-                zratio = old_div(self._pixel_dim[2], self._pixel_dim[0])
-                #adjust size in z to be close to isotropic and
-                #double the resolution
-                newz = int(zratio * roi.GetSize()[2]) * upsampling
-                newzspace = (old_div(float(roi.GetSize()[2]), float(newz))) * self._pixel_dim[2]
-                newx = roi.GetSize()[0] * upsampling
-                newxspace = old_div(self._pixel_dim[0], float(upsampling))
-                newy = roi.GetSize()[1] * upsampling
-                newyspace = old_div(self._pixel_dim[1], float(upsampling))
-                #Do the resampling
-                refine = sitk.ResampleImageFilter()
-                refine.SetInterpolator(sitk.sitkBSpline)
-                refine.SetSize((newx, newy, newz))
-                refine.SetOutputOrigin(roi.GetOrigin())
-                refine.SetOutputSpacing((newxspace, newyspace, newzspace))
-                refine.SetOutputDirection(roi.GetDirection())
-                simg = refine.Execute(roi)
+                #resample the Region of Interest to improve resolution of
+                #derivatives and give closer to isotropic voxels
+                #adjust size in z to be close to isotropic and double
+                #the resolution
+                size = roi.GetSize()
+                newz = int(zratio * size[2]) * upsampling
+                newzspace = float(size[2]) / float(newz) * zspace
+                newsize = (size[0] * upsampling, size[1] * upsampling, newz)
+                newspacing = newspace + [newzspace]
             else:
                 seed = sitk.RegionOfInterest(self.cells,
                                              region[3:5],
@@ -976,32 +1104,30 @@ class Volume(object):
                 roi = self.smoothed[i]
                 #resample the Region of Interest to improve resolution
                 #of derivatives
-                newx = roi.GetSize()[0] * upsampling
-                newxspace = old_div(self._pixel_dim[0], float(upsampling))
-                newy = roi.GetSize()[1] * upsampling
-                newyspace = old_div(self._pixel_dim[1], float(upsampling))
-                #Do the resampling
-                refine = sitk.ResampleImageFilter()
-                refine.SetInterpolator(sitk.sitkBSpline)
-                refine.SetSize((newx, newy))
-                refine.SetOutputOrigin(roi.GetOrigin())
-                refine.SetOutputSpacing((newxspace, newyspace))
-                refine.SetOutputDirection(roi.GetDirection())
-                simg = refine.Execute(roi)
-            refine.SetInterpolator(sitk.sitkNearestNeighbor)
-            seed = refine.Execute(seed)
-            if self._getMinMax(seed)[1] < 1:
-                seed = self._replaceSeed(seed)
+                size = roi.GetSize()
+                newsize = (size[0] * upsampling, size[1] * upsampling)
+                newspacing = newspace
+            #Do the resampling; every image has a fixed interpolator, so
+            #no filter is reconfigured between images
+            def refine(img, interpolator):
+                return sitk.Resample(img, newsize, sitk.Transform(),
+                                     interpolator, roi.GetOrigin(),
+                                     newspacing, roi.GetDirection())
+
+            if high_quality:
+                simg = refine(roi, sitk.sitkBSpline)
+            else:
+                simg = refine(roi, sitk.sitkLinear)
+            seed = refine(seed, sitk.sitkNearestNeighbor)
+            if self._getMax(seed) < 1:
+                seed = self._replaceSeed(seed, report)
             else:
                 #smooth the perimeter of the binary seed
                 dm = sitk.SignedMaurerDistanceMap(seed, False, False, False)
-                mindist = self._getMinMax(dm)[0]
+                mindist = self._getMin(dm)
                 #shrink seed by 20%
                 seed = dm <= 0.2 * mindist
-                labels = sitk.ConnectedComponent(seed)
-                labelstats = self._getLabelShape(labels)
-                ind = np.argmin(labelstats['border size'])
-                seed = labels == ind + 1
+                seed = self._interiorComponent(seed)
 
             if self.debug:
                 sitk.WriteImage(sitk.RescaleIntensity(seed, 0, 255),
@@ -1027,8 +1153,7 @@ class Volume(object):
                                                         insideIsPositive=False,
                                                         squaredDistance=False,
                                                         useImageSpacing=True)
-                    stack.append(cv.Execute(phi0, sitk.Cast(im,
-                                                            sitk.sitkFloat32)))
+                    stack.append(cv.Execute(phi0, _asFloat32(im)))
                 seg = sitk.JoinSeries(stack)
                 seg.CopyInformation(simg)
             else:
@@ -1038,104 +1163,118 @@ class Volume(object):
                                                     useImageSpacing=True)
 
                 seg = cv.Execute(phi0,
-                                 sitk.Cast(simg, sitk.sitkFloat32))
-                print("... Edge-free Active Contour Segmentation Completed")
-                print(("... ... Elapsed Iterations: {:d}"
-                      .format(cv.GetElapsedIterations())))
-                print(("... ... Change in RMS Error: {:.3e}"
-                      .format(cv.GetRMSChange())))
-
-            self.levelsets.append(seg)
-            b = sitk.BinaryThreshold(seg, 1e-7, 1e7)
+                                 _asFloat32(simg))
+                report.append("... Edge-free Active Contour Segmentation "
+                              "Completed")
+                report.append("... ... Elapsed Iterations: {:d}"
+                              .format(cv.GetElapsedIterations()))
+                report.append("... ... Change in RMS Error: {:.3e}"
+                              .format(cv.GetRMSChange()))
+
+            b = sitk.GreaterEqual(seg, 1e-7)
             #Get connected regions
             if self.opening:
                 b = sitk.BinaryMorphologicalOpening(b, upsampling)
-            r = sitk.ConnectedComponent(b)
-            labelstats = self._getLabelShape(r)
-            label = np.argmax(labelstats['volume']) + 1
-            b = (r == label) * (i + 1)
-            tmp = sitk.Image(self._img.GetSize(), sitk.sitkUInt8) 
-            tmp.CopyInformation(self._img)
-            resampler = sitk.ResampleImageFilter()
-            resampler.SetReferenceImage(tmp)
-            resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-            tmp = resampler.Execute(b)
+            #relabel by size so the largest connected region is label 1
+            r = sitk.RelabelComponent(sitk.ConnectedComponent(b),
+                                      sortByObjectSize=True)
+            b = sitk.BinaryThreshold(r, 1, 1, i + 1, 0)
+            #resample back onto the region of interest only
+            tmp = sitk.Resample(b, roi, sitk.Transform(),
+                                sitk.sitkNearestNeighbor)
             if self.fillholes:
-                tmp = sitk.BinaryFillhole(tmp)
-            newcells = sitk.Add(newcells, tmp)
-            #Handle Overlap
-            if self.handle_overlap:
-                maxlabel = self._getMinMax(newcells)[1]
-                if maxlabel > (i + 1):
-                    newcells = self._classifyShared(i, newcells, True)
-        self.cells = newcells
-
-    def _classifyShared(self, i, cells, previous):
+                tmp = sitk.BinaryFillhole(tmp, foregroundValue=i + 1)
+            return seg, tmp, report
+
+        #the active contours of the regions are independent and SimpleITK
+        #releases the GIL while filtering, so evolve them concurrently and
+        #only merge the results into the label image in order
+        with ThreadPoolExecutor() as pool:
+            results = list(pool.map(evolve, range(len(self._regions)),
+                                    self._regions))
+        for i, (seg, tmp, report) in enumerate(results):
+            print("\n-------------------------------------------")
+            print(("Evolving Edge-free Active Contour for Cell {:d}"
+                  .format(i + 1)))
+            print("-------------------------------------------")
+            for line in report:
+                print(line)
+            self.levelsets.append(seg)
+            claims.append((self._regions[i][0:dimension], tmp))
+            self._addRegionLabel(newcells, tmp,
+                                 self._regions[i][0:dimension], shared)
+        #Handle Overlap, all at once
+        if self.handle_overlap:
+            self._classifyShared(newcells, shared, claims, True)
+        self.cells = self._labelImage(newcells)
+
+    def _classifyShared(self, cells, shared, claims, previous):
         """
         If segmented objects overlap and **handle_overlap** is *True*,
         this will attempt to reclassify the shared voxels using the
-        thresholded seed to train a support vector machine. Of course,
+        thresholded seed of each object: a shared voxel is assigned to the
+        object whose seed voxels it is closest to in terms of Mahalanobis
+        distance. Of course,
         this relies on the seed to not overlap. The user strategy to get
         good results from this would be to use an active contour method,
         with an aggressive thresholding method to produce the seed.
 
-        Returns
-        -------
-        A modified version of cells attribute with the overlapping objects
-        reclassified.
+        All overlaps are resolved together once every object is segmented.
+        **shared** marks the voxels claimed by more than one object and
+        **claims** holds the region index and label image of each object.
+        The shared voxels are relabelled in place in the label array
+        **cells**.
         """
-        #cells overlap so use SVM to classify shared voxels
+        sidx = np.flatnonzero(shared)
+        if sidx.size == 0:
+            return
+        #cells overlap so classify shared voxels by distance to the seeds
         print("... ... ... WARNING: Segmentation overlapped a previous")
-        print("... ... ... Using SVM to classify shared voxels")
-        a = sitk.GetArrayFromImage(cells)
+        print("... ... ... Using Mahalanobis distance to classify shared voxels")
         ind2space = np.array(self._pixel_dim, float)[::-1]
+        empty = np.empty(0, np.intp)
         # we can use seeds from a previous segmentation as training
         # for geodesic and edge-free cases
         if previous:
-            t = sitk.GetArrayFromImage(self.cells)
-            p1 = np.argwhere(t == (i + 1)) * ind2space
+            seeds = _labelIndices(sitk.GetArrayViewFromImage(self.cells))
             print("\n")
         else:
             print(("... ... ... The training data are often insufficient "
                    "for this segmentation method."))
             print(("... ... ... Please consider using Geodesic or "
                    "EdgeFree options.\n"))
-            p1 = np.argwhere(a == (i + 1)) * ind2space
-        if p1.size == 0:
-            print(("... ... ... The seed from thresholding does not contain any voxels. "
-                   "Aborting the SVM to fix overlap."))
+            #only the voxels of a single object hold its label
+            seeds = _labelIndices(np.where(shared, 0, cells))
+        fits = [_gaussianFit(np.column_stack(np.unravel_index(
+            seeds.get(k + 1, empty), cells.shape)) * ind2space)
+            for k in range(len(claims))]
+        if any(fit is None for fit in fits):
+            print(("... ... ... The seed from thresholding of some cells does not "
+                   "contain any voxels. Their shared voxels go to the other cells."))
             print("... ... ... Please consider using a different thresholding method.\n")
 
-            return cells
-
-        g1 = np.array([i + 1] * p1.shape[0], int)
-        labels = np.unique(a)
-        b = np.copy(a)
-        for l in labels[labels > (i + 1)]:
-            if previous:
-                p2 = np.argwhere(t == (l - i - 1)) * ind2space
-            else:
-                p2 = np.argwhere(a == (l - i - 1)) * ind2space
-            unknown1 = np.argwhere(a == l) * ind2space
-            unknown2 = np.argwhere(a == (i + 1)) * ind2space
-            unknown3 = np.argwhere(a == (l - i - 1)) * ind2space
-            unknown = np.vstack((unknown1, unknown2, unknown3))
-            g2 = np.array([l - i - 1] * p2.shape[0], int)
-            X = np.vstack((p1, p2))
-            scaler = preprocessing.StandardScaler().fit(X)
-            y = np.hstack((g1, g2))
-            clf = svm.SVC(kernel='rbf', degree=3, gamma=2)
-            clf.fit(scaler.transform(X), y)
-            classification = clf.predict(scaler.transform(unknown))
-            b[a == l] = classification[0:unknown1.shape[0]]
-            b[a == (i + 1)] = classification[unknown1.shape[0]:
-                                             unknown1.shape[0] +
-                                             unknown2.shape[0]]
-            b[a == (l - i - 1)] = classification[unknown1.shape[0] +
-                                                 unknown2.shape[0]:]
-        cells = sitk.Cast(sitk.GetImageFromArray(b), sitk.sitkUInt8)
-        cells.CopyInformation(self._img)
-        return cells
+        #the first claimant owns a shared voxel until a later one is closer
+        owner = np.zeros(sidx.size, np.intp)
+        for k, (index, label) in enumerate(claims):
+            arr = sitk.GetArrayViewFromImage(label)
+            #array axes are ordered (z, y, x), the reverse of the index
+            offset = np.array(index[::-1], np.intp)
+            block = tuple(slice(o, o + n) for o, n in zip(offset, arr.shape))
+            local = np.nonzero(shared[block] & (arr != 0))
+            if local[0].size == 0:
+                continue
+            voxels = np.column_stack(local) + offset
+            pos = np.searchsorted(sidx, np.ravel_multi_index(voxels.T,
+                                                              cells.shape))
+            for o in np.unique(owner[pos]):
+                sel = owner[pos] == o
+                if o == 0 or fits[o - 1] is None:
+                    owner[pos[sel]] = k + 1
+                elif fits[k] is not None:
+                    closer = _closerTo(voxels[sel] * ind2space,
+                                       fits[k], fits[o - 1])
+                    owner[pos[sel][closer]] = k + 1
+        cells.ravel()[sidx] = owner
 
     def writeSurfaces(self):
         """"""
@@ -1146,100 +1285,93 @@ class Volume(object):
         #create and write the STLs
         stl = vtk.vtkSTLWriter()
         polywriter = vtk.vtkPolyDataWriter()
-        for i, c in enumerate(self._regions):
-            resampler = sitk.ResampleImageFilter()
-            resampler.SetReferenceImage(self.cells)
-            resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-            if self._img.GetDimension() == 3:
-                roi = sitk.RegionOfInterest(self.cells == (i + 1),
-                                            c[3:], c[0:3])
-                spacing = self._pixel_dim
-                extent = [0, self._img.GetSize()[0],
-                          0, self._img.GetSize()[1],
-                          0, self._img.GetSize()[2]]
-                iso = vtk.vtkImageMarchingCubes()
-                iso.ComputeNormalsOff()
+
+        #the image size and spacing are the same for every cell; the
+        #display triad is placed from them too, since the reused importer
+        #only ever holds the last cell's block
+        dimension = self._img.GetDimension()
+        size = self._img.GetSize()
+        if dimension == 3:
+            spacing = self._pixel_dim
+        else:
+            spacing = self._pixel_dim + [1]
+
+        #one VTK pipeline is built here and reused for every cell, only
+        #swapping the imported array, its extent and the contour value
+        importer = vti.vtkImageImportFromArray()
+        importer.SetDataSpacing(spacing)
+        if dimension == 3:
+            iso = vtk.vtkImageMarchingCubes()
+            iso.ComputeNormalsOff()
+        else:
+            iso = vtk.vtkMarchingSquares()
+        iso.SetInputConnection(importer.GetOutputPort())
+        triangles = vtk.vtkGeometryFilter()
+        triangles.SetInputConnection(iso.GetOutputPort())
+        output = triangles
+        if dimension == 3:
+            smooth = vtk.vtkWindowedSincPolyDataFilter()
+            smooth.SetInputConnection(triangles.GetOutputPort())
+            smooth.NormalizeCoordinatesOn()
+            smooth.SetNumberOfIterations(30)
+            smooth.SetPassBand(0.01)
+            smooth.SetFeatureAngle(120.0)
+
+            laplaceSmooth = vtk.vtkSmoothPolyDataFilter()
+            laplaceSmooth.SetInputConnection(smooth.GetOutputPort())
+            laplaceSmooth.SetNumberOfIterations(5)
+            output = laplaceSmooth
+
+        #a single scan of the label image gives the bounding box of every cell
+        boxes = find_objects(sitk.GetArrayViewFromImage(self.cells),
+                             max_label=len(self._regions))
+        for i, (c, box) in enumerate(zip(self._regions, boxes)):
+            region = [int(x) for x in c[0:dimension]]
+            end = [r + int(x) for r, x in zip(region, c[dimension:2 * dimension])]
+            #crop to the cell and the voxel its mask is dilated by, within its
+            #region; an empty cell keeps the whole region
+            if box is not None:
+                box = box[::-1]
+                index = [max(r, b.start - 1) for r, b in zip(region, box)]
+                end = [min(e, b.stop + 1) for e, b in zip(end, box)]
             else:
-                roi = sitk.RegionOfInterest(self.cells == (i + 1),
-                                            c[3:5], c[0:2])
-                spacing = self._pixel_dim + [1]
-                extent = [0, self._img.GetSize()[0],
-                          0, self._img.GetSize()[1],
-                          0, 0]
-                iso = vtk.vtkMarchingSquares()
+                index = region
+            extent = [e - x for e, x in zip(end, index)]
+            roi = sitk.RegionOfInterest(self.cells, extent, index) == (i + 1)
             roi = sitk.BinaryDilate(roi, 1)
             if not(self.levelsets):
-                smoothed = sitk.Cast(roi,
-                                     sitk.sitkFloat32) * self.smoothed[i]
-                resampler.SetInterpolator(sitk.sitkBSpline)
-                smoothlabel = resampler.Execute(smoothed)
-                a = vti.vtkImageImportFromArray()
-                a.SetDataSpacing(spacing)
-                a.SetDataExtent(extent)
-                n = sitk.GetArrayFromImage(smoothlabel)
-                a.SetArray(n)
-                a.Update()
-
-                voi = vtk.vtkExtractVOI()
-                voi.SetInputData(a.GetOutput())
-                voi.SetVOI(c[0] - 1, c[0]+c[3] + 1,
-                           c[1] - 1, c[1]+c[4] + 1,
-                           c[2] - 1, c[2]+c[5] + 1)
-                voi.SetSampleRate(1, 1, 1)
-                voi.IncludeBoundaryOn()
-                voi.Update()
-
-                iso.SetInputData(voi.GetOutput())
-                iso.SetValue(0, self.thresholds[i])
-                iso.Update()
-
+                smoothed = sitk.RegionOfInterest(
+                    self.smoothed[i], extent,
+                    [x - r for x, r in zip(index, region)])
+                label = sitk.Cast(roi, sitk.sitkFloat32) * smoothed
+                value = self.thresholds[i]
             else:
-                resampler.SetInterpolator(sitk.sitkLinear)
-                lvlset = resampler.Execute(self.levelsets[i])
-                lvl_roi = sitk.RegionOfInterest(lvlset, c[3:], c[0:3])
-                lvlset = sitk.Cast(roi, sitk.sitkFloat32) * lvl_roi
-                lvl_label = resampler.Execute(lvlset)
-                a = vti.vtkImageImportFromArray()
-                a.SetDataSpacing(spacing)
-                a.SetDataExtent(extent)
-                n = sitk.GetArrayFromImage(lvl_label)
-                a.SetArray(n)
-                a.Update()
-                voi = vtk.vtkExtractVOI()
-                voi.SetInputData(a.GetOutput())
-                voi.SetVOI(c[0] - 1, c[0]+c[3] + 1,
-                           c[1] - 1, c[1]+c[4] + 1,
-                           c[2] - 1, c[2]+c[5] + 1)
-                voi.SetSampleRate(1, 1, 1)
-                voi.IncludeBoundaryOn()
-                voi.Update()
-
-                iso.SetInputData(a.GetOutput())
+                lvlset = sitk.Resample(self.levelsets[i], roi, sitk.Transform(),
+                                       sitk.sitkLinear)
+                label = sitk.Cast(roi, sitk.sitkFloat32) * lvlset
                 if self.active == "Geodesic":
-                    iso.SetValue(0, -1e-7)
+                    value = -1e-7
                 else:
-                    iso.SetValue(0, 1e-7)
-                iso.Update()
-
-            triangles = vtk.vtkGeometryFilter()
-            triangles.SetInputConnection(iso.GetOutputPort())
-            triangles.Update()
-
+                    value = 1e-7
+            #the surface is extracted from the cell block with a voxel before
+            #and two after it, clipped to the image, so only that block is
+            #padded and imported rather than the whole image
+            lower = [min(1, x) for x in index]
+            upper = [min(2, size[k] - index[k] - extent[k])
+                     for k in range(dimension)]
+            label = sitk.ConstantPad(label, lower, upper, 0.0)
+            start = [x - l for x, l in zip(index, lower)] + [0]
+
+            importer.SetDataExtent([start[0], 0, start[1], 0, start[2], 0])
+            #the importer copies the buffer, so a view is enough
+            importer.SetArray(sitk.GetArrayViewFromImage(label))
+            iso.SetValue(0, value)
+            output.Update()
+            #the pipeline output is overwritten by the next cell
+            polydata = vtk.vtkPolyData()
+            polydata.DeepCopy(output.GetOutput())
+            self.surfaces.append(polydata)
             if self._img.GetDimension() == 3:
-                smooth = vtk.vtkWindowedSincPolyDataFilter()
-                smooth.SetInputConnection(triangles.GetOutputPort())
-                smooth.NormalizeCoordinatesOn()
-                smooth.SetNumberOfIterations(30)
-                smooth.SetPassBand(0.01)
-                smooth.SetFeatureAngle(120.0)
-                smooth.Update()
-
-                laplaceSmooth = vtk.vtkSmoothPolyDataFilter()
-                laplaceSmooth.SetInputConnection(smooth.GetOutputPort())
-                laplaceSmooth.SetNumberOfIterations(5)
-                laplaceSmooth.Update()
-
-                self.surfaces.append(laplaceSmooth.GetOutput())
                 filename = 'cell{:02d}.stl'.format(i + 1)
                 stl.SetFileName(
                     str(os.path.normpath(self._output_dir +
@@ -1247,7 +1379,6 @@ class Volume(object):
                 stl.SetInputData(self.surfaces[-1])
                 stl.Write()
             else:
-                self.surfaces.append(triangles.GetOutput())
                 filename = 'cell{:0d}.vtk'.format(i + 1)
                 polywriter.SetFileName(
                     str(os.path.normpath(self._output_dir +
@@ -1313,7 +1444,11 @@ class Volume(object):
             aRenderer.ResetCamera()
             aCamera.Dolly(1.5)
 
-            bounds = a.GetOutput().GetBounds()
+            #the triad sits at the origin of the whole image, whose extent
+            #is the same for every cell
+            bounds = []
+            for k in range(3):
+                bounds += [0.0, size[k] * spacing[k]]
             triad = vtk.vtkCubeAxesActor()
             l = 0.5 * (bounds[5] - bounds[4])
             triad.SetBounds([bounds[0], bounds[0] + l,
@@ -1399,25 +1534,18 @@ class Volume(object):
         Replaces image read from disk with and image that is corrected for
         intensity change with depth.
         """
-        stack = []
-        intensities = []
-        size = self._img.GetSize()
-        intensities = np.zeros(size[2], np.float32)
-        for sl in range(size[2]):
-            s = sitk.Extract(self._img, [size[0], size[1], 0], [0, 0, sl])
-            intensities[sl] = self._getMinMax(s)[1]
-            stack.append(s)
-        low = np.percentile(intensities, 2)
-        high = np.percentile(intensities, 98)
-        w = np.ones(size[2], np.float32)
+        #array is ordered (z, y, x) so slice maxima reduce over the last two axes
+        arr = np.array(sitk.GetArrayViewFromImage(self._img), np.float32)
+        intensities = arr.max(axis=(1, 2))
+        low, high = np.percentile(intensities, [2, 98])
+        w = np.ones(arr.shape[0], np.float32)
         w[intensities < low] = 0.0
         w[intensities > high] = 0.0
-        x = np.arange(size[2], dtype=np.float32)
+        x = np.arange(arr.shape[0], dtype=np.float32)
         fit = np.polyfit(x, intensities, 1, w=w)
-        ratios = old_div(fit[1], (fit[0] * x + fit[1]))
-        for i, s in enumerate(stack):
-            stack[i] = sitk.Cast(s, sitk.sitkFloat32) * ratios[i]
-        nimg = sitk.JoinSeries(stack)
+        ratios = (fit[1] / (fit[0] * x + fit[1])).astype(np.float32)
+        arr *= ratios[:, None, None]
+        nimg = sitk.GetImageFromArray(arr)
         nimg.CopyInformation(self._img)
         self._img = nimg
 
@@ -1439,15 +1567,15 @@ class Volume(object):
             for sl in range(size[2]):
                 s = sitk.Extract(img, [size[0], size[1], 0], [0, 0, sl])
                 seg = thres.Execute(s)
-                stack.append(sitk.BinaryFillhole(seg != 0))
+                stack.append(sitk.BinaryFillhole(seg, foregroundValue=1))
                 values.append(thres.GetThreshold())
         else:
             for sl in range(size[2]):
                 s = sitk.Extract(img, [size[0], size[1], 0], [0, 0, sl])
-                t = self._getMinMax(s)[1]
+                t = self._getMax(s)
                 t *= ratio
-                seg = sitk.BinaryThreshold(s, t, 1e7)
-                stack.append(sitk.BinaryFillhole(seg != 0))
+                seg = sitk.GreaterEqual(s, t)
+                stack.append(sitk.BinaryFillhole(seg, foregroundValue=1))
                 values.append(t)
  
         seg = sitk.JoinSeries(stack)
@@ -1455,17 +1583,14 @@ class Volume(object):
         return seg, max(values), min(values), values
 
     def scale2D(self, img, thresh):
-        stack = []
-        size = img.GetSize()
-        maxt = np.max(thresh)
-        for i, t in enumerate(thresh):
-            s = sitk.Extract(img, [size[0], size[1], 0], [0, 0, i])
-            # maximum difference from max of 300%
-            if (old_div(maxt, t)) < 3:
-                stack.append(sitk.Cast(s, sitk.sitkFloat32) * (old_div(maxt, t)))
-            else:
-                stack.append(sitk.Cast(s, sitk.sitkFloat32))
-        nimg = sitk.JoinSeries(stack)
+        #scale all slices at once; the array is ordered (z, y, x)
+        arr = np.array(sitk.GetArrayViewFromImage(img), np.float32)
+        thresh = np.asarray(thresh, np.float32)
+        factors = np.max(thresh) / thresh
+        # maximum difference from max of 300%
+        factors[~(factors < 3)] = 1.0
+        arr *= factors[:, None, None]
+        nimg = sitk.GetImageFromArray(arr)
         nimg.CopyInformation(img)
         return nimg
 
@@ -1478,7 +1603,7 @@ class Volume(object):
         on each slice in the 3-D stack independently.
         """
         gd = sitk.GeodesicActiveContourLevelSetImageFilter()
-        gd.SetMaximumRMSError(old_div(rms, float(upsampling)))
+        gd.SetMaximumRMSError(rms / float(upsampling))
         gd.SetNumberOfIterations(active_iterations)
         gd.SetPropagationScaling(propagation)
         gd.SetCurvatureScaling(curvature)
@@ -1489,12 +1614,12 @@ class Volume(object):
             im = sitk.Extract(simg, [size[0], size[1], 0], [0, 0, sl])
             s = sitk.Extract(seed, [size[0], size[1], 0], [0, 0, sl])
             canny = sitk.CannyEdgeDetection(
-                sitk.Cast(im, sitk.sitkFloat32),
+                _asFloat32(im),
                 lowerThreshold=cannyLower,
                 upperThreshold=cannyUpper,
                 variance=canny_variance)
             canny = sitk.InvertIntensity(canny, 1)
-            canny = sitk.Cast(canny, sitk.sitkFloat32)
+            canny = _asFloat32(canny)
             d = sitk.SignedMaurerDistanceMap(s,
                                              insideIsPositive=False,
                                              squaredDistance=False,
@@ -1504,12 +1629,15 @@ class Volume(object):
         seg.CopyInformation(simg)
         return seg
 
-    def _replaceSeed(self, seed):
-        print(("WARNING: seed for active segmentation was zero; using sphere"
-               " with diameter half of minimum region of interest edge."))
+    def _replaceSeed(self, seed, report):
+        #called from the segmentation worker threads, so the warning goes
+        #into the region's report to be printed under its header
+        report.append(("WARNING: seed for active segmentation was zero; using "
+                       "sphere with diameter half of minimum region of "
+                       "interest edge."))
         size = np.array(seed.GetSize(), int)
         idx = size * np.array(seed.GetSpacing(), float) / 2.0
-        d = old_div(np.min(size), 2)
+        d = int(np.min(size) // 2)
         seed[seed.TransformPhysicalPointToIndex(idx)] = 1
         seed = sitk.BinaryDilate(seed, d)
         return seed
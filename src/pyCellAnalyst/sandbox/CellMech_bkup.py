@@ -1,5 +1,8 @@
 import vtk,os,random
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import numpy as np
+from vtk.util import numpy_support
 from scipy.optimize import minimize
 from scipy.spatial import KDTree
 from scipy.linalg import sqrtm
@@ -15,7 +18,7 @@ def obj(x,sF,devF,R,sv,mv,tv,material,spatial,rc,sc):
     pcoords = vtk.vtkFloatArray()
     pcoords.SetNumberOfComponents(3)
     pcoords.SetNumberOfTuples(nm.GetNumberOfPoints())
-    for i in xrange(nm.GetNumberOfPoints()):
+    for i in range(nm.GetNumberOfPoints()):
         p = [0.,0.,0.]
         nm.GetPoint(i,p)
         p = np.dot(nF,p-rc)
@@ -57,6 +60,10 @@ def obj(x,sF,devF,R,sv,mv,tv,material,spatial,rc,sc):
     diff = max([abs(sv-vol_int),abs(sv-vol_union)])
     return diff
 
+def liststls(directory):
+    #single scan of the directory, keeping only the STL files
+    return sorted(e.path for e in os.scandir(directory) if e.is_file() and e.name.lower().endswith('.stl'))
+
 class CellMech(object):
     '''
     USAGE: Will read STL files from two directories and calculate the complete strain tensor for each volume.
@@ -65,8 +72,8 @@ class CellMech(object):
            ref_dir - the directory containing the STL files corresponding to the reference (undeformed) state
            def_dir - the directory containing the STL files corresponding to the deformed state
     MEMBER ATTRIBUTES:
-           self.rmeshes - list of delaunay tessalations of the reference STL files
-           self.dmeshes - list of delaunay tessalations of the deformed STL files
+           self.rpoints, self.dpoints - lists of (N,3) point arrays of the reference and deformed surfaces
+           self.rconn, self.dconn - lists of (M,3) consistently oriented triangle connectivity arrays of the reference and deformed surfaces
            self.defmeshes - list of the reference delaunay tesselations deformed to the shape of the deformed STLs
            self.cell_strains - list of numpy arrays containing the homogeneous strain tensor for each cell
            self.rvols - volumes of reference state STLs
@@ -84,8 +91,10 @@ class CellMech(object):
             raise SystemExit("You must indicate a directory containing deformed state STLs. Terminating...")
         self._ref_dir = ref_dir
         self._def_dir = def_dir
-        self.rmeshes = []
-        self.dmeshes = []
+        self.rpoints = []
+        self.dpoints = []
+        self.rconn = []
+        self.dconn = []
         self.rsurfs = []
         self.dsurfs = []
         self.rcentroids = []
@@ -106,50 +115,58 @@ class CellMech(object):
         self._deform()
 
     def _readstls(self):
-        for fname in sorted(os.listdir(self._ref_dir)):
-            if '.stl' in fname.lower():
-                reader = vtk.vtkSTLReader()
-                reader.SetFileName(self._ref_dir+'/'+fname)
-                reader.Update()
-                triangles = vtk.vtkTriangleFilter()
-                triangles.SetInputConnection(reader.GetOutputPort())
-                triangles.Update()
-                self.rsurfs.append(triangles.GetOutput())
-
-                dl = vtk.vtkDelaunay3D()
-                dl.SetInputConnection(triangles.GetOutputPort())
-                dl.Update()
-                self.rmeshes.append(dl)
-
-                vol, cent, axes = self._getMassProps(self.rmeshes[-1])
+        rfiles = liststls(self._ref_dir)
+        dfiles = liststls(self._def_dir)
+        if [os.path.basename(f) for f in rfiles] != [os.path.basename(f) for f in dfiles]:
+            raise SystemExit("The STL files in the reference and deformed directories are not named the same. Terminating...")
+        #each file is independent and the work is done inside VTK filters, so load them concurrently
+        pool = ThreadPool(cpu_count())
+        try:
+            results = pool.map(self._loadstl,rfiles+dfiles)
+        finally:
+            pool.close()
+            pool.join()
+        for i,(surf,pts,conn,vol,cent,axes) in enumerate(results):
+            if i < len(rfiles):
+                self.rsurfs.append(surf)
+                self.rpoints.append(pts)
+                self.rconn.append(conn)
                 self.rvols.append(vol)
                 self.rcentroids.append(cent)
                 self.raxes.append(axes)
-
-        for fname in sorted(os.listdir(self._def_dir)):
-            if '.stl' in fname.lower():
-                reader = vtk.vtkSTLReader()
-                reader.SetFileName(self._def_dir+'/'+fname)
-                reader.Update()
-                triangles = vtk.vtkTriangleFilter()
-                triangles.SetInputConnection(reader.GetOutputPort())
-                triangles.Update()
-                self.dsurfs.append(triangles.GetOutput())
-
-                dl = vtk.vtkDelaunay3D()
-                dl.SetInputConnection(triangles.GetOutputPort())
-                dl.Update()
-                self.dmeshes.append(dl)
-
-                vol, cent, axes = self._getMassProps(self.dmeshes[-1])
+            else:
+                self.dsurfs.append(surf)
+                self.dpoints.append(pts)
+                self.dconn.append(conn)
                 self.dvols.append(vol)
                 self.dcentroids.append(cent)
                 self.daxes.append(axes)
 
+    def _loadstl(self,filename):
+        reader = vtk.vtkSTLReader()
+        reader.SetFileName(filename)
+        reader.Update()
+        triangles = vtk.vtkTriangleFilter()
+        triangles.SetInputConnection(reader.GetOutputPort())
+        triangles.Update()
+
+        #orient the triangles consistently for the surface integrals
+        orient = vtk.vtkPolyDataNormals()
+        orient.SetInputConnection(triangles.GetOutputPort())
+        orient.SplittingOff()
+        orient.ConsistencyOn()
+        orient.Update()
+
+        #materialize the surface as arrays once
+        pts = numpy_support.vtk_to_numpy(orient.GetOutput().GetPoints().GetData()).reshape(-1,3).copy()
+        conn = numpy_support.vtk_to_numpy(orient.GetOutput().GetPolys().GetData()).reshape(-1,4)[:,1:].copy()
+
+        vol, cent, axes = self._getMassProps(pts,conn)
+        return triangles.GetOutput(),pts,conn,vol,cent,axes
 
     def _deform(self):
         #align centroids
-        for i in xrange(len(self.rcentroids)):
+        for i in range(len(self.rcentroids)):
             # volumetric strains
             self.vstrains.append(self.dvols[i]/self.rvols[i]-1)
             tv = self.dcentroids[i]-self.rcentroids[i]
@@ -163,7 +180,7 @@ class CellMech(object):
             a = 1./3.*np.trace(U)
             sU = a*np.eye(3)
             devU = U-sU
-            print "Starting optimization for Cell %d" % i
+            print("Starting optimization for Cell {:d}".format(i))
             args=(sU,devU,R,self.dvols[i],self.rvols[i],tv,self.rsurfs[i],self.dsurfs[i],self.rcentroids[i],self.dcentroids[i])
             constraints = {"type":"eq","fun":matchVol,"args":args}
             res = minimize(obj,x,args=args,method="SLSQP",bounds=bounds,jac=False,constraints=constraints,options={"disp":True})
@@ -178,30 +195,19 @@ class CellMech(object):
         rc = np.array(self.rcentroids)
         dc = np.array(self.dcentroids)
         #make all line segments
-        n = rc.shape[0]
-        X = []
-        x = []
-        ds = []
-        for i in xrange(n-1):
-            for j in xrange(n-i-1):
-                X.append(rc[i,:] - rc[j+i+1,:])
-                x.append(dc[i,:] - dc[j+i+1,:])
-        X = np.array(X,float)
-        x = np.array(x,float)
+        i,j = np.triu_indices(rc.shape[0],1)
+        X = rc[i,:]-rc[j,:]
+        x = dc[i,:]-dc[j,:]
         #assemble the system
-        dX = np.zeros((X.shape[0],6),float)
-        ds = np.zeros((X.shape[0],1),float)
-        for i in xrange(X.shape[0]):
-            dX[i,0] = 2*X[i,0]**2
-            dX[i,1] = 2*X[i,1]**2
-            dX[i,2] = 2*X[i,2]**2
-            dX[i,3] = 4*X[i,0]*X[i,1]
-            dX[i,4] = 4*X[i,0]*X[i,2]
-            dX[i,5] = 4*X[i,1]*X[i,2]
-
-            ds[i,0] = np.linalg.norm(x[i,:])**2-np.linalg.norm(X[i,:])**2
+        dX = np.column_stack((2*X[:,0]**2,
+                              2*X[:,1]**2,
+                              2*X[:,2]**2,
+                              4*X[:,0]*X[:,1],
+                              4*X[:,0]*X[:,2],
+                              4*X[:,1]*X[:,2]))
+        ds = (np.sum(x**2,axis=1)-np.sum(X**2,axis=1)).reshape(-1,1)
 
-        E = np.linalg.lstsq(dX,ds)[0]
+        E = np.linalg.lstsq(dX,ds,rcond=None)[0]
         E = np.array([[E[0,0],E[3,0],E[4,0]],[E[3,0],E[1,0],E[5,0]],[E[4,0],E[5,0],E[2,0]]],float)
         self.ecm_strain = E
 
@@ -213,16 +219,16 @@ class CellMech(object):
         N = len(self.rcentroids)
         X = []
         x = []
-        for i in xrange(N):
+        for i in range(N):
             W = np.zeros((3,3),float)
             w = np.zeros((3,3),float)
-            for j in xrange(3):
+            for j in range(3):
                 W[j,:] = self.rcentroids[nn[i,j+1]]-self.rcentroids[i]
                 w[j,:] = self.dcentroids[nn[i,j+1]]-self.dcentroids[i]
             X.append(W)
             x.append(w)
         #Solve the linear system for each pointwise F
-        for i in xrange(N):
+        for i in range(N):
             W = X[i]
             w = x[i]
             A = np.zeros((9,9),float)
@@ -239,48 +245,29 @@ class CellMech(object):
             F = np.linalg.solve(A,b)
             self.localFs.append(F.reshape(3,3))
 
-    def _getMassProps(self,mesh):
-        tvol = []
-        tcent = []
-        for i in xrange(mesh.GetOutput().GetNumberOfCells()):
-            tetra = mesh.GetOutput().GetCell(i)
-            points = tetra.GetPoints().GetData()
-            center = [0.,0.,0.]
-            tetra.TetraCenter(points.GetTuple(0),
-                    points.GetTuple(1),
-                    points.GetTuple(2),
-                    points.GetTuple(3),
-                    center)
-            tcent.append(center)
-            tvol.append(tetra.ComputeVolume(points.GetTuple(0),
-                    points.GetTuple(1),
-                    points.GetTuple(2),
-                    points.GetTuple(3)))
-        tvol = np.array(tvol)
-        tcent = np.array(tcent)
+    def _getMassProps(self,pts,conn):
+        #divergence theorem: sum over the signed tetrahedra spanned by the
+        #origin and each consistently oriented surface triangle
+        P = pts[conn].astype(float)
+        p0 = P[:,0]
+        p1 = P[:,1]
+        p2 = P[:,2]
+        tvol = np.einsum('ij,ij->i',p0,np.cross(p1,p2))/6.
+        #inward oriented triangles give a negative total
+        if np.sum(tvol) < 0:
+            tvol = -tvol
         volume = np.sum(tvol)
-        cx = np.sum(tvol*tcent[:,0])/volume
-        cy = np.sum(tvol*tcent[:,1])/volume
-        cz = np.sum(tvol*tcent[:,2])/volume
-        centroid = np.hstack((cx,cy,cz))
+        tsum = p0+p1+p2
+        centroid = np.dot(tvol,tsum)/4./volume
 
-        I = np.zeros((3,3),float)
-        for i in xrange(len(tvol)):
-            tcent[i,:] -= centroid
-            I[0,0] += tvol[i]*(tcent[i,1]**2+tcent[i,2]**2)
-            I[0,1] += -tvol[i]*(tcent[i,0]*tcent[i,1])
-            I[0,2] += -tvol[i]*(tcent[i,0]*tcent[i,2])
-            I[1,1] += tvol[i]*(tcent[i,0]**2+tcent[i,2]**2)
-            I[1,2] += -tvol[i]*(tcent[i,1]*tcent[i,2])
-            I[2,2] += tvol[i]*(tcent[i,0]**2+tcent[i,1]**2)
-        I[1,0] = I[0,1]
-        I[2,0] = I[0,2]
-        I[2,1] = I[1,2]
+        #exact second moment of each tetrahedron about the origin,
+        #V/20*(sum of outer products of vertices + outer product of their sum)
+        M = (np.dot(p0.T*tvol,p0)+np.dot(p1.T*tvol,p1)+np.dot(p2.T*tvol,p2)+np.dot(tsum.T*tvol,tsum))/20.
+        M -= volume*np.outer(centroid,centroid)
+        I = np.trace(M)*np.eye(3)-M
 
-        [lam,vec] = np.linalg.eig(I)
-        order = np.argsort(lam)[::-1]
-        l = lam[order]
-        v = vec[:,order]
+        #symmetric solver; real eigenpairs in ascending order
+        lam,vec = np.linalg.eigh(I)
 
         a = []
         c = 5./2./volume
@@ -288,8 +275,6 @@ class CellMech(object):
         a.append(np.sqrt(c*(lam[0]+lam[2]-lam[1])))
         a.append(np.sqrt(c*(lam[0]+lam[1]-lam[2])))
 
-        axes = np.zeros((3,3),float)
-        for i in xrange(3):
-            axes[:,i] = a[i]*vec[:,i]
+        axes = vec*np.array(a)
 
         return volume,centroid,axes
@@ -1,4 +1,4 @@
-import os, re, string, warnings, platform, vtk, fnmatch, shutil
+import os, re, warnings, platform, vtk, fnmatch, shutil
 from PIL import Image
 from PIL import ImageOps
 from PIL import ImageMath
@@ -112,8 +112,8 @@ class Volume(object):
         self._pixel_dim = pixel_dim
         self._stain = stain
         self._display = display
-        self._left = map(int,left)
-        self._right = map(int,right)
+        self._left = list(map(int,left))
+        self._right = list(map(int,right))
         self._counter = int(counter)
         self.cells = []
         if self._stain == 'cell':
@@ -184,7 +184,7 @@ class Volume(object):
             pass
 
         cnt = 0
-        for i in xrange(len(self._thresh)):
+        for i in range(len(self._thresh)):
             img = self._stack[i]
             img.save(self._gray_dir+self._path_dlm+'cell%04d.tif' % cnt,'TIFF')
             cnt += 1
@@ -199,7 +199,7 @@ class Volume(object):
             pass
         files = fnmatch.filter(sorted(os.listdir(local_dir)),'*.tif')
         counter = re.search("[0-9]*\.tif", files[0]).group()
-        prefix = self._path_dlm+string.replace(files[0],counter,'')
+        prefix = self._path_dlm+files[0].replace(counter,'')
         counter = str(len(counter)-4)
         prefixImageName = local_dir + prefix
 
@@ -253,11 +253,11 @@ class Volume(object):
         itk_img = sitk.GetImageFromArray(a)
         itk_img.SetSpacing([self._pixel_dim[0],self._pixel_dim[1],self._pixel_dim[2]])
         
-        print "\n"
-        print "-------------------------------------------------------"
-        print "-- Applying Patch Based Denoising - this can be slow --"
-        print "-------------------------------------------------------"
-        print "\n"
+        print("\n")
+        print("-------------------------------------------------------")
+        print("-- Applying Patch Based Denoising - this can be slow --")
+        print("-------------------------------------------------------")
+        print("\n")
         pb = sitk.PatchBasedDenoisingImageFilter()
         pb.KernelBandwidthEstimationOn()
         pb.SetNoiseModel(3) #use a Poisson noise model since this is confocal
@@ -278,11 +278,11 @@ class Volume(object):
         edge = sitk.Cast(sitk.BoundedReciprocal( grad ),sitk.sitkFloat32)
 
 
-        print "\n"
-        print "-------------------------------------------------------"
-        print "---- Thresholding to deterimine initial level sets ----"
-        print "-------------------------------------------------------"
-        print "\n"
+        print("\n")
+        print("-------------------------------------------------------")
+        print("---- Thresholding to deterimine initial level sets ----")
+        print("-------------------------------------------------------")
+        print("\n")
         t = 0.5
         seed = sitk.BinaryThreshold(fimg,t*intensity)
         #Opening (Erosion/Dilation) step to remove islands smaller than 2 voxels in radius)
@@ -390,7 +390,7 @@ class Volume(object):
         regions.Update()
 
         N = regions.GetNumberOfExtractedRegions()
-        for i in xrange(N):
+        for i in range(N):
             r = vtk.vtkConnectivityFilter()
             r.SetInputConnection(iso.GetOutputPort())
             r.SetExtractionModeToSpecifiedRegions()
@@ -414,7 +414,7 @@ class Volume(object):
 
             self.cells.append(dl)
 
-        for i in xrange(N):
+        for i in range(N):
             g = vtk.vtkGeometryFilter()
             g.SetInputConnection(self.cells[i].GetOutputPort())
             t = vtk.vtkTriangleFilter()
@@ -423,7 +423,7 @@ class Volume(object):
             #get the surface points of the cells and save to points attribute
             v = t.GetOutput()
             points = []
-            for j in xrange(v.GetNumberOfPoints()):
+            for j in range(v.GetNumberOfPoints()):
                 p = [0,0,0]
                 v.GetPoint(j,p)
                 points.append(p)
@@ -528,10 +528,10 @@ class Volume(object):
 
             [lam,vec] = np.linalg.eig(np.cov(x.T))
             max_loc = np.zeros((3,1),int)
-            for i in xrange(3):
+            for i in range(3):
                 max_loc[i,0] = np.argmax(abs(vec[:,i]))
             dimensions = np.zeros((3,1),float)
-            for i in xrange(3):
+            for i in range(3):
                 dimensions[max_loc[i,0],0] = lam[i]
 
             self.dimensions.append(dimensions)
@@ -540,7 +540,7 @@ class Volume(object):
             dl = c
             tvol = []
             tcent = []
-            for i in xrange(dl.GetOutput().GetNumberOfCells()):
+            for i in range(dl.GetOutput().GetNumberOfCells()):
                 tetra = dl.GetOutput().GetCell(i)
 
                 points = tetra.GetPoints().GetData()
@@ -559,14 +559,14 @@ class Volume(object):
             vol = np.sum(tvol)
             #get the cell centroid
             c = np.zeros((3,),float)
-            for i in xrange(len(tvol)):
+            for i in range(len(tvol)):
                 c[0] += tvol[i]*tcent[i][0]
                 c[1] += tvol[i]*tcent[i][1]
                 c[2] += tvol[i]*tcent[i][2]
             c /= vol
 
             I = np.zeros((3,3),float)
-            for i in xrange(len(tvol)):
+            for i in range(len(tvol)):
                 tcent[i][0] -= c[0]
                 tcent[i][1] -= c[1]
                 tcent[i][2] -= c[2]
@@ -585,7 +585,7 @@ class Volume(object):
             order = np.argsort(lam)
             v = vec[order,:]
             global_order = []
-            for i in xrange(3):
+            for i in range(3):
                 global_order.append(np.argmax(abs(v[:,i])))
 
             global_order = global_order[::-1]